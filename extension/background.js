@@ -112,11 +112,15 @@ async function handleStartCapture(tabId, serverUrl, asrProvider) {
 
     ws.onmessage = (event) => {
       try {
-        const data = JSON.parse(event.data);
-        chrome.tabs.sendMessage(tabId, {
-          type: 'SERVER_MESSAGE',
-          data: data
-        }).catch(err => console.error('[BG] Failed to forward message:', err));
+        // The server batches events per audio chunk into one array
+        const parsed = JSON.parse(event.data);
+        const events = Array.isArray(parsed) ? parsed : [parsed];
+        for (const data of events) {
+          chrome.tabs.sendMessage(tabId, {
+            type: 'SERVER_MESSAGE',
+            data: data
+          }).catch(err => console.error('[BG] Failed to forward message:', err));
+        }
       } catch (err) {
         console.error('[BG] Failed to parse server message:', err);
       }
@@ -1,15 +1,13 @@
 # server/app/asr.py
+import asyncio
 import os
 import tempfile
-import asyncio
-from typing import List, Dict
-from pydub import AudioSegment
-from io import BytesIO
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import logging
 import numpy as np
-import whisper
-import wave
-from io import BytesIO
+import ctranslate2
+from faster_whisper import WhisperModel
 import ssl
 
 # Disable SSL verification for model download
@@ -17,139 +15,570 @@ ssl._create_default_https_context = ssl._create_unverified_context
 
 logger = logging.getLogger(__name__)
 
+INT16_SCALE = np.float32(1.0 / 32768.0)
+
+# Windows quieter than this RMS level are treated as silence and never reach Whisper
+SILENCE_RMS = 0.005
+
+# Longest stretch of uncommitted audio kept for a streaming session
+MAX_BUFFER_SECONDS = 30
+
+# Decoded audio waiting for the ASR beyond this is dropped, oldest first
+MAX_PENDING_SECONDS = 10
+
+# Containers ffmpeg can demux from a pipe; anything else (MP4/M4A/MOV may keep
+# their index at the end) is spooled to a seekable temp file first
+STREAMABLE_TYPES = frozenset({
+    "audio/webm", "video/webm", "audio/ogg", "application/ogg",
+    "audio/wav", "audio/x-wav", "audio/wave", "audio/vnd.wave"
+})
+
+def is_streamable(content_type: str) -> bool:
+    """Whether an upload of this content type can be decoded while it arrives"""
+    return (content_type or "").split(";")[0].strip().lower() in STREAMABLE_TYPES
+
+def pcm16_to_float32(data: bytes):
+    """Convert little-endian int16 PCM to float32 in [-1, 1)"""
+    # Scale straight into one float32 output, no intermediate upcast
+    return np.multiply(np.frombuffer(data, dtype=np.int16), INT16_SCALE, dtype=np.float32)
+
+class FFmpegStreamDecoder:
+    """
+    Long-lived ffmpeg process decoding one continuous WebM stream
+    Chunks are written to stdin, 16kHz mono PCM is read back from stdout
+    Create with start(); everything runs on the event loop without blocking it
+    """
+    
+    def __init__(self, proc, max_pending: int):
+        self.proc = proc
+        
+        # Decoded float32 arrays, filled by the reader task
+        self._pcm = deque()
+        self._pending = 0
+        self.max_pending = max_pending
+        self._ready = asyncio.Event()
+        self._eof = False
+        self._reader = asyncio.create_task(self._read_stdout())
+    
+    @classmethod
+    async def start(cls, sample_rate: int = 16000):
+        """Spawn ffmpeg and start reading its output"""
+        proc = await asyncio.create_subprocess_exec(
+            'ffmpeg', '-loglevel', 'quiet', '-i', 'pipe:0',
+            '-f', 's16le', '-ar', str(sample_rate), '-ac', '1', 'pipe:1',
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE
+        )
+        return cls(proc, max_pending=sample_rate * MAX_PENDING_SECONDS)
+    
+    async def _read_stdout(self):
+        """Read PCM from ffmpeg until it exits"""
+        leftover = b""
+        try:
+            while True:
+                data = await self.proc.stdout.read(65536)
+                if not data:
+                    break
+                
+                # Keep a trailing odd byte for the next read
+                data = leftover + data
+                usable = len(data) - len(data) % 2
+                leftover = data[usable:]
+                
+                if usable:
+                    self._push(pcm16_to_float32(data[:usable]))
+        finally:
+            self._eof = True
+            self._ready.set()
+    
+    def _push(self, audio_array):
+        """Queue decoded PCM, dropping the oldest once the ASR falls too far behind"""
+        self._pcm.append(audio_array)
+        self._pending += len(audio_array)
+        
+        # Dropping decoded audio is safe; the encoded stream itself stays intact
+        while self._pending > self.max_pending and len(self._pcm) > 1:
+            dropped = self._pcm.popleft()
+            self._pending -= len(dropped)
+            logger.warning(f"ASR falling behind, dropped {len(dropped)} decoded samples")
+        
+        self._ready.set()
+    
+    async def feed(self, audio_bytes: bytes):
+        """Write an encoded chunk to ffmpeg, waiting if its input pipe is full"""
+        self.proc.stdin.write(audio_bytes)
+        await self.proc.stdin.drain()
+    
+    def read_available(self):
+        """Return all PCM decoded so far, or None"""
+        chunks = []
+        while self._pcm:
+            chunks.append(self._pcm.popleft())
+        self._pending = 0
+        
+        if not chunks:
+            return None
+        return np.concatenate(chunks)
+    
+    async def read(self):
+        """Wait for decoded PCM and return all of it, or None once ffmpeg has exited"""
+        while not self._pcm:
+            if self._eof:
+                return None
+            self._ready.clear()
+            await self._ready.wait()
+        return self.read_available()
+    
+    async def close(self):
+        """Stop ffmpeg and the reader task"""
+        try:
+            self.proc.stdin.close()
+            await asyncio.wait_for(self.proc.wait(), timeout=2)
+        except Exception:
+            if self.proc.returncode is None:
+                self.proc.kill()
+                await self.proc.wait()
+        
+        try:
+            await asyncio.wait_for(self._reader, timeout=1)
+        except Exception:
+            self._reader.cancel()
+
+
 class ASRProcessor:
+    """Shared Whisper model; per-connection audio state lives in ASRSession"""
+    
     def __init__(self):
-        logger.info("Loading Whisper model...")
-        self.model = whisper.load_model("base")
-        self.audio_buffer = np.array([], dtype=np.float32)
-        self.chunk_count = 0
+        # Loaded on the executor thread, see load_model()
+        self.model = None
+        self._model_future = None
         self.sample_rate = 16000
+        # Single worker keeps model calls ordered and off the event loop
+        self._executor = ThreadPoolExecutor(max_workers=1)
+    
+    def load_model(self):
+        """
+        Start loading the model in the background
+        Transcriptions share the same single-worker executor, so they run after it
+        """
+        if self._model_future is None:
+            self._model_future = self._executor.submit(self._load_model)
+        return self._model_future
+    
+    def _load_model(self):
+        if self.model is not None:
+            return
+        
+        # GPU in FP16 when CUDA is available, otherwise INT8 on CPU
+        if ctranslate2.get_cuda_device_count() > 0:
+            device, compute_type = "cuda", "float16"
+        else:
+            device, compute_type = "cpu", "int8"
+        
+        logger.info(f"Loading Whisper model on {device} ({compute_type})...")
+        self.model = WhisperModel("base", device=device, compute_type=compute_type)
         logger.info("Whisper model loaded")
     
-    async def push_audio_chunk_and_get_events(self, audio_bytes):
+    @property
+    def model_ready(self):
+        return self.model is not None
+    
+    def _sync_transcribe(self, audio, **options):
+        """Blocking Whisper call, runs on the executor thread"""
+        self._load_model()
+        segments, _ = self.model.transcribe(audio, language="en", beam_size=1, vad_filter=True, **options)
+        # Segments are generated lazily, so decode them here rather than on the event loop
+        return list(segments)
+    
+    async def transcribe(self, audio, **options):
+        """Transcribe on the executor, off the event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, lambda: self._sync_transcribe(audio, **options)
+        )
+    
+    def session(self):
+        """New per-connection (or per-request) buffer and streaming state on this model"""
+        return ASRSession(self)
+
+
+class ASRSession:
+    """
+    Audio buffer, streaming decoder and LocalAgreement state for one websocket client or request
+    Only the Whisper model and its executor are shared, through ASRProcessor
+    """
+    
+    def __init__(self, asr: ASRProcessor):
+        # Shared model and executor
+        self.asr = asr
+        self.chunk_count = 0
+        self.sample_rate = asr.sample_rate
+        # Preallocated sample buffer; only self._buf[:self._n] holds audio
+        self.max_samples = self.sample_rate * MAX_BUFFER_SECONDS
+        self._buf = np.empty(self.max_samples, dtype=np.float32)
+        self._n = 0
+        # ffmpeg decoder for this session's websocket stream, if any
+        self._stream = None
+        # LocalAgreement state: audio before self._commit is already transcribed
+        self._commit = 0
+        self._last_pass = 0
+        self.confirmed_text = ""
+        self.pending_words = []
+        self._inflight = False
+    
+    @property
+    def audio_buffer(self):
+        """View of the audio accumulated so far"""
+        return self._buf[:self._n]
+    
+    @audio_buffer.setter
+    def audio_buffer(self, audio_array):
+        self._reset()
+        self._append(np.asarray(audio_array, dtype=np.float32))
+    
+    def _reset(self):
+        """Drop buffered audio and streaming hypothesis"""
+        self._n = 0
+        self._commit = 0
+        self._last_pass = 0
+        self.confirmed_text = ""
+        self.pending_words = []
+    
+    def _append(self, audio_array):
+        """Copy samples into the buffer, growing it only on overflow"""
+        end = self._n + len(audio_array)
+        if self._stream is not None and end > self.max_samples:
+            # Streaming sessions never grow past max_samples
+            audio_array = self._make_room(audio_array)
+            end = self._n + len(audio_array)
+        if end > len(self._buf):
+            self._buf = np.resize(self._buf, max(end, 2 * len(self._buf)))
+        self._buf[self._n:end] = audio_array
+        self._n = end
+    
+    def _make_room(self, audio_array):
+        """
+        Nothing committed for too long: drop the oldest audio so the buffer plus
+        audio_array keeps only the most recent half window; returns what is left to append
+        """
+        keep = self.max_samples // 2
+        dropped = self._n + len(audio_array) - keep
+        
+        if dropped >= self._n:
+            audio_array = audio_array[dropped - self._n:]
+            self._n = 0
+        else:
+            self._buf[:self._n - dropped] = self._buf[dropped:self._n]
+            self._n -= dropped
+        
+        self._commit = max(0, self._commit - dropped)
+        self._last_pass = max(0, self._last_pass - dropped)
+        self.pending_words = []
+        logger.warning(f"Audio buffer over {MAX_BUFFER_SECONDS}s without a commit, dropped {dropped} samples")
+        return audio_array
+    
+    def _trim(self):
+        """Drop audio before the commit point"""
+        if self._commit > 0:
+            remaining = self._n - self._commit
+            self._buf[:remaining] = self._buf[self._commit:self._n]
+            self._last_pass = max(0, self._last_pass - self._commit)
+            self._n = remaining
+            self._commit = 0
+    
+    async def start_stream(self):
+        """Start a persistent decoder for a new streaming session"""
+        await self.stop_stream()
+        self._reset()
+        self._stream = await FFmpegStreamDecoder.start(self.sample_rate)
+        logger.info("Started streaming decoder")
+    
+    async def stop_stream(self):
+        """Shut down the streaming decoder, if running"""
+        if self._stream is not None:
+            stream, self._stream = self._stream, None
+            await stream.close()
+            logger.info("Stopped streaming decoder")
+    
+    async def feed_stream(self, audio_bytes: bytes):
         """
-        Process audio chunks and return ASR events
-        Expects raw audio or WebM, converts to proper format for Whisper
+        Write an encoded chunk to the session's decoder
+        Decoded audio is transcribed by read_stream_events(), so this never waits on the model
         """
+        self.chunk_count += 1
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Chunk #{self.chunk_count}: {len(audio_bytes)} bytes")
+        
+        await self._stream.feed(audio_bytes)
+    
+    async def read_stream_events(self):
+        """Wait for newly decoded session audio and return its ASR events, or None when the stream ended"""
+        stream = self._stream
+        if stream is None:
+            return None
+        
+        audio_array = await stream.read()
+        if audio_array is None:
+            return None
+        
+        return await self.push_decoded_pcm(audio_array)
+    
+    async def push_decoded_pcm(self, audio_array):
+        """Append 16kHz mono float32 PCM and return ASR events"""
         try:
-            if not audio_bytes or len(audio_bytes) == 0:
-                logger.warning("Empty audio chunk")
-                return []
+            # Append to buffer
+            self._append(audio_array)
             
-            self.chunk_count += 1
-            logger.info(f"Chunk #{self.chunk_count}: {len(audio_bytes)} bytes")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Audio buffer: {self._n} samples (~{self._n/self.sample_rate:.1f}s)")
             
-            # Try to decode as WebM first
-            audio_array = await self._decode_audio(audio_bytes)
+            # Streaming: re-decode the uncommitted window every 1 second of new audio
+            if self._stream is not None:
+                if not self._inflight and self._n - self._last_pass >= self.sample_rate:
+                    return await self._transcribe_window()
+                return [{"type": "interim", "text": " ".join(self.pending_words) or "Listening..."}]
             
-            if audio_array is not None:
-                # Append to buffer
-                self.audio_buffer = np.concatenate([self.audio_buffer, audio_array])
-                
-                logger.info(f"Audio buffer: {len(self.audio_buffer)} samples (~{len(self.audio_buffer)/self.sample_rate:.1f}s)")
-                
-                # Process every 1 second of audio
-                if len(self.audio_buffer) >= self.sample_rate * 1 :
-                    return await self._transcribe_buffer()
-                else:
-                    return [{"type": "interim", "text": f"Listening... ({self.chunk_count} chunks)"}]
+            # Process every 1 second of audio
+            if self._n >= self.sample_rate * 1 :
+                return await self._transcribe_buffer()
             else:
-                return [{"type": "interim", "text": "Processing audio..."}]
+                return [{"type": "interim", "text": f"Listening... ({self.chunk_count} chunks)"}]
             
         except Exception as e:
             logger.error(f"ASR error: {e}", exc_info=True)
             return [{"type": "interim", "text": f"Error: {str(e)[:100]}"}]
     
-    async def _decode_audio(self, audio_bytes):
-        """Decode audio from WebM or raw bytes"""
+    async def _run_transcription(self, audio, **options):
+        """Transcribe on the executor while new chunks keep arriving"""
+        self._inflight = True
         try:
-            # Save to temp file
-            temp_path = "/tmp/audio_chunk.webm"
-            with open(temp_path, 'wb') as f:
-                f.write(audio_bytes)
-            
-            # Use ffmpeg to convert WebM to WAV
-            import subprocess
-            wav_path = "/tmp/audio_chunk.wav"
-            
-            result = subprocess.run([
-                'ffmpeg',
-                '-i', temp_path,
-                '-acodec', 'pcm_s16le',
-                '-ar', '16000',
-                '-ac', '1',
-                '-y',
-                wav_path
-            ], capture_output=True, timeout=10)
-            
-            if result.returncode != 0:
-                logger.warning(f"FFmpeg error: {result.stderr.decode()}")
-                return None
+            return await self.asr.transcribe(audio, **options)
+        finally:
+            self._inflight = False
+    
+    @staticmethod
+    def _is_silent(audio):
+        """Cheap energy gate run before Whisper"""
+        if len(audio) == 0:
+            return True
+        rms = float(np.sqrt(np.dot(audio, audio) / len(audio)))
+        return rms < SILENCE_RMS
+    
+    @staticmethod
+    def _normalize_word(word):
+        return word.strip(".,!?;:\"'").lower()
+    
+    async def _transcribe_window(self):
+        """
+        Transcribe the uncommitted audio window (LocalAgreement-2)
+        Words that two consecutive passes agree on are committed as final,
+        the rest is reported as an interim hypothesis
+        """
+        try:
+            self._last_pass = self._n
+            
+            if self._is_silent(self._buf[self._commit:self._n]):
+                # Nothing to decode: skip past the silence and drop the stale hypothesis
+                logger.debug("Silent window, skipping transcription")
+                self._commit = self._n
+                self.pending_words = []
+                self._trim()
+                return [{"type": "interim", "text": "No speech detected"}]
+            
+            # Snapshot the window; chunks arriving during inference are appended behind it
+            window = self._buf[self._commit:self._n].copy()
+            
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Transcribing window of {len(window)} samples...")
+            
+            segments = await self._run_transcription(
+                window,
+                word_timestamps=True,
+                initial_prompt=self.confirmed_text[-200:] or None
+            )
+            words = [(w.word.strip(), w.end) for segment in segments for w in (segment.words or [])]
+            
+            # Longest common prefix with the previous hypothesis
+            agreed = 0
+            for (word, _), previous in zip(words, self.pending_words):
+                if self._normalize_word(word) != self._normalize_word(previous):
+                    break
+                agreed += 1
+            
+            events = []
+            if agreed:
+                committed = " ".join(word for word, _ in words[:agreed])
+                self.confirmed_text = f"{self.confirmed_text} {committed}".strip()
+                # Next window starts where the last committed word ends
+                self._commit = min(self._n, self._commit + int(words[agreed - 1][1] * self.sample_rate))
+                logger.info(f"✅ Committed: {committed}")
+                events.append({"type": "final", "text": committed})
             
-            # Read WAV file
-            with open(wav_path, 'rb') as f:
-                wav_data = f.read()
+            self.pending_words = [word for word, _ in words[agreed:]]
+            self._trim()
+            if self.pending_words:
+                events.append({"type": "interim", "text": " ".join(self.pending_words)})
+            elif not words:
+                events.append({"type": "interim", "text": "No speech detected"})
             
-            # Parse WAV header and extract audio
-            audio_array = self._parse_wav(wav_data)
-            return audio_array
+            return events
             
         except Exception as e:
-            logger.warning(f"Failed to decode audio: {e}")
-            return None
+            logger.error(f"Transcription error: {e}", exc_info=True)
+            return [{"type": "interim", "text": f"Transcription error: {str(e)[:50]}"}]
     
-    def _parse_wav(self, wav_data):
-        """Parse WAV file and return audio array"""
+    async def _ffmpeg_decode(self, source: str, chunks=None):
+        """
+        Decode `source` (a path, or 'pipe:0' fed from `chunks`) with one ffmpeg process
+        Yields 16kHz mono float32 arrays while input is still being written
+        """
+        proc = await asyncio.create_subprocess_exec(
+            'ffmpeg', '-loglevel', 'error', '-i', source,
+            '-f', 's16le', '-ar', str(self.sample_rate), '-ac', '1', 'pipe:1',
+            stdin=asyncio.subprocess.PIPE if chunks is not None else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        
+        async def feed():
+            try:
+                async for chunk in chunks:
+                    if chunk:
+                        proc.stdin.write(chunk)
+                        await proc.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError):
+                logger.warning("ffmpeg closed its input early")
+            finally:
+                proc.stdin.close()
+        
+        # Feed stdin and collect errors concurrently so ffmpeg never blocks on a full pipe
+        writer = asyncio.create_task(feed()) if chunks is not None else None
+        errors = asyncio.create_task(proc.stderr.read())
         try:
-            wav_file = BytesIO(wav_data)
-            with wave.open(wav_file, 'rb') as wav:
-                n_channels = wav.getnchannels()
-                sample_width = wav.getsampwidth()
-                frame_rate = wav.getframerate()
-                n_frames = wav.getnframes()
+            leftover = b""
+            while True:
+                data = await proc.stdout.read(65536)
+                if not data:
+                    break
                 
-                logger.info(f"WAV: {n_channels}ch, {sample_width}B, {frame_rate}Hz, {n_frames} frames")
+                data = leftover + data
+                usable = len(data) - len(data) % 2
+                leftover = data[usable:]
                 
-                # Read audio data
-                audio_data = wav.readframes(n_frames)
-                audio_array = np.frombuffer(audio_data, dtype=np.int16).astype(np.float32) / 32768.0
-                
-                # Resample if necessary
-                if frame_rate != self.sample_rate:
-                    logger.info(f"Resampling from {frame_rate}Hz to {self.sample_rate}Hz")
-                    import librosa
-                    audio_array = librosa.resample(audio_array, orig_sr=frame_rate, target_sr=self.sample_rate)
+                if usable:
+                    yield pcm16_to_float32(data[:usable])
+            
+            if writer is not None:
+                await writer
+            
+            await proc.wait()
+            stderr = (await errors).decode(errors="replace").strip()
+            if proc.returncode != 0 or stderr:
+                logger.warning(f"ffmpeg exited with {proc.returncode}: {stderr or 'no error output'}")
+        finally:
+            if writer is not None:
+                writer.cancel()
+            errors.cancel()
+            if proc.returncode is None:
+                proc.kill()
+            await proc.wait()
+    
+    def decode_stream(self, chunks):
+        """Decode an async iterable of encoded bytes through ffmpeg's stdin"""
+        return self._ffmpeg_decode('pipe:0', chunks)
+    
+    def decode_file(self, path: str):
+        """Decode a file ffmpeg can seek in (needed for MP4/M4A with a trailing index)"""
+        return self._ffmpeg_decode(path)
+    
+    async def _append_decoded(self, pcm_arrays) -> int:
+        """Append every decoded array to the buffer, returns samples added"""
+        added = 0
+        async for audio_array in pcm_arrays:
+            self._append(audio_array)
+            added += len(audio_array)
+        return added
+    
+    async def append_stream(self, chunks, content_type: str = None, reset: bool = False):
+        """
+        Decode an uploaded body into the buffer, returns samples added
+        WebM/Ogg/WAV are decoded while they arrive; other types are spooled to a temp file.
+        A failed piped decode is retried from the spooled copy
+        """
+        if reset:
+            self._reset()
+        
+        spool = await asyncio.to_thread(tempfile.NamedTemporaryFile, delete=False)
+        try:
+            async def tee():
+                async for chunk in chunks:
+                    await asyncio.to_thread(spool.write, chunk)
+                    yield chunk
+            
+            body = tee()
+            added = 0
+            if is_streamable(content_type):
+                added = await self._append_decoded(self.decode_stream(body))
+                if added == 0:
+                    logger.warning(f"Piped decode of {content_type} produced no audio, retrying from file")
+            
+            if added == 0:
+                # Spool whatever ffmpeg did not read (everything, for types it has to seek in)
+                async for _ in body:
+                    pass
                 
-                return audio_array
+                await asyncio.to_thread(spool.close)
+                added = await self._append_decoded(self.decode_file(spool.name))
+            
+            logger.info(f"Decoded {added} samples (~{added/self.sample_rate:.1f}s)")
+            return added
+        finally:
+            await asyncio.to_thread(spool.close)
+            await asyncio.to_thread(os.remove, spool.name)
+    
+    async def _transcribe_text(self):
+        """Transcribe and clear the buffer, returns "" when there is no speech"""
+        logger.info(f"Transcribing {self._n} samples...")
+        
+        if self._is_silent(self._buf[:self._n]):
+            logger.info("Silent buffer, skipping transcription")
+            self._n = 0
+            return ""
+        
+        # Hand the audio off and start a fresh buffer for incoming chunks
+        audio = self._buf[:self._n].copy()
+        self._n = 0
+        
+        # Transcribe
+        segments = await self._run_transcription(audio)
+        
+        return " ".join(segment.text.strip() for segment in segments).strip()
+    
+    async def transcribe_all(self):
+        """Transcribe the whole buffer in one pass and return the text"""
+        try:
+            if self._n == 0:
+                return "No audio recorded"
+            
+            return await self._transcribe_text()
+            
         except Exception as e:
-            logger.error(f"WAV parsing error: {e}")
-            return None
+            logger.error(f"Transcription error: {e}", exc_info=True)
+            return f"Error: {str(e)[:100]}"
     
     async def _transcribe_buffer(self):
         """Transcribe accumulated audio buffer"""
         try:
-            if len(self.audio_buffer) == 0:
+            if self._n == 0:
                 return []
             
-            logger.info(f"Transcribing {len(self.audio_buffer)} samples...")
-            
-            # Transcribe
-            result = self.model.transcribe(
-                self.audio_buffer,
-                language="en",
-                fp16=False,
-                task="transcribe"
-            )
-            
-            text = result.get("text", "").strip()
+            text = await self._transcribe_text()
             
             if text:
                 logger.info(f"✅ Transcribed: {text}")
-                self.audio_buffer = np.array([], dtype=np.float32)
                 return [{"type": "final", "text": text}]
             else:
                 logger.info("No speech detected")
-                self.audio_buffer = np.array([], dtype=np.float32)
                 return [{"type": "interim", "text": "No speech detected"}]
                 
         except Exception as e:
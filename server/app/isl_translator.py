@@ -1,32 +1,58 @@
 # server/app/isl_translator.py
 import json
 from typing import List, Dict
+import ahocorasick
+
+# Longest phrase (in words) considered when matching
+MAX_NGRAM = 3
+
 class ISLTranslator:
     def __init__(self, mapping_path):
         with open(mapping_path, 'r', encoding='utf8') as f:
             self.mapping = json.load(f)  # e.g., {"hello":[{"sign":"sign_hello","duration":1.0}], ...}
 
+        # Phrases are padded with spaces so matches always fall on word boundaries
+        self.automaton = ahocorasick.Automaton()
+        for phrase in self.mapping:
+            length = len(phrase.split())
+            if 1 <= length <= MAX_NGRAM:
+                self.automaton.add_word(f" {phrase} ", (phrase, length))
+        self.automaton.make_automaton()
+
     def translate(self, text: str) -> List[Dict]:
-        text = text.lower()
-        # simple token matching: longest phrase first
+        words = text.lower().split()
+        if not words or len(self.automaton) == 0:
+            return []
+
+        # char offset of each word in the padded text -> word index
+        padded = f" {' '.join(words)} "
+        word_at = {}
+        offset = 1
+        for idx, word in enumerate(words):
+            word_at[offset] = idx
+            offset += len(word) + 1
+
+        # one pass over the text: longest phrase starting at each word
+        longest = {}
+        for end, (phrase, length) in self.automaton.iter(padded):
+            idx = word_at[end - len(phrase)]
+            if length > longest.get(idx, (None, 0))[1]:
+                longest[idx] = (phrase, length)
+
+        # greedy: take the longest match, otherwise skip the word
         seq = []
-        words = text.split()
+        running_duration = 0.0
         i = 0
         while i < len(words):
-            matched = False
-            # try 3-word ngrams down to 1
-            for L in (3,2,1):
-                if i+L <= len(words):
-                    phrase = ' '.join(words[i:i+L])
-                    if phrase in self.mapping:
-                        entries = self.mapping[phrase]
-                        for e in entries:
-                            # e might be {"sign":"sign_hello","duration":1.0}
-                            seq.append({'sign': e['sign'], 'start': sum(x.get('duration',1.0) for x in seq), 'duration': e.get('duration',1.0)})
-                        i += L
-                        matched = True
-                        break
-            if not matched:
-                # fallback: skip word
+            match = longest.get(i)
+            if match is None:
                 i += 1
+                continue
+            phrase, length = match
+            for e in self.mapping[phrase]:
+                # e might be {"sign":"sign_hello","duration":1.0}
+                duration = e.get('duration', 1.0)
+                seq.append({'sign': e['sign'], 'start': running_duration, 'duration': duration})
+                running_duration += duration
+            i += length
         return seq
@@ -1,31 +1,228 @@
+import asyncio
+import hashlib
 import logging
 import os
-import imageio
+import shutil
 import numpy as np
 from typing import List, Dict, Optional
-from datetime import datetime
+from concurrent.futures import Executor
 import cv2
 from PIL import Image
 
 logger = logging.getLogger(__name__)
 
+# Rows above/below the letter image holding the label and progress bar
+INFO_TOP_ROWS = 45
+INFO_BOTTOM_ROWS = 45
+# Rendered text patches (a few KB each) kept per process
+TEXT_CACHE_SIZE = 256
+
+# Generated GIFs remembered per (text, duration)
+GIF_CACHE_SIZE = 256
+
+# Supported image formats
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp')
+
+class CharFilter(dict):
+    """
+    str.translate table that keeps only allowed characters
+    The table holds just the allowed code points; everything else is dropped without
+    being stored, so arbitrary input can't grow it
+    """
+    
+    def __init__(self, allowed):
+        # Multi-character names (e.g. from "SPACE.png") can never match a single code point
+        super().__init__((ord(c), ord(c)) for c in allowed if len(c) == 1)
+    
+    def __missing__(self, codepoint: int):
+        return None
+
+# Frame background color
+BACKGROUND = 240
+
+# Rendered text patches keyed by (text, scale, color, thickness); one cache per process
+_text_cache = {}
+
+def _render_gif(letters: List[str], letter_images: Dict[str, np.ndarray],
+                duration_per_letter: float, output_path: str) -> Optional[str]:
+    """
+    Compose and encode a letter GIF
+    Top-level so it can run in a worker process
+    """
+    try:
+        # Letters that get a frame (spaces become blank frames)
+        frame_letters = []
+        for letter_idx, letter in enumerate(letters):
+            if letter == ' ' or letter in letter_images:
+                frame_letters.append((letter_idx, letter))
+            else:
+                logger.warning(f"No image for letter: {letter}")
+        
+        # All frames live in one preallocated (N, H, W, 3) canvas
+        canvas = np.full((len(frame_letters), 400, 600, 3), BACKGROUND, dtype=np.uint8)
+        
+        for frame_idx, (letter_idx, letter) in enumerate(frame_letters):
+            if letter != ' ':
+                _create_letter_frame(canvas[frame_idx], letter_images[letter])
+            _add_letter_info(canvas[frame_idx], letter, letter_idx, len(letters))
+        
+        # One frame per letter; the GIF delay holds it on screen
+        frames = [Image.fromarray(frame) for frame in canvas]
+        letter_ms = max(int(duration_per_letter * 1000), 10)
+        durations_ms = [letter_ms] * len(frames)
+        
+        # Save as GIF
+        if frames:
+            logger.info(f"Saving GIF with {len(frames)} frames")
+            
+            # Write to a temp name first so a half-written file is never served
+            tmp_path = f"{output_path}.{os.getpid()}.tmp"
+            frames[0].save(
+                tmp_path,
+                format="GIF",
+                save_all=True,
+                append_images=frames[1:],
+                duration=durations_ms,
+                loop=0,
+                disposal=2,
+                optimize=True
+            )
+            os.replace(tmp_path, output_path)
+            logger.info(f"GIF created: {output_path} ({len(frames)} frames)")
+            return output_path
+        else:
+            logger.error("No frames created")
+            return None
+        
+    except Exception as e:
+        logger.error(f"GIF creation error: {e}", exc_info=True)
+        return None
+
+def _create_letter_frame(frame: np.ndarray, letter_img: np.ndarray):
+    """Paste letter image centered into a blank frame (in place)"""
+    try:
+        frame_height, frame_width = frame.shape[:2]
+    
+        # Get letter image dimensions
+        img_height, img_width = letter_img.shape[:2]
+    
+        # Calculate position to center letter image
+        x_offset = (frame_width - img_width) // 2
+        y_offset = (frame_height - img_height) // 2
+    
+        # Ensure offsets are non-negative
+        x_offset = max(0, x_offset)
+        y_offset = max(0, y_offset)
+    
+        # Place letter image on frame
+        x_end = min(frame_width, x_offset + img_width)
+        y_end = min(frame_height, y_offset + img_height)
+    
+        img_x_end = x_end - x_offset
+        img_y_end = y_end - y_offset
+    
+        frame[y_offset:y_end, x_offset:x_end] = letter_img[:img_y_end, :img_x_end]
+    
+    except Exception as e:
+        logger.error(f"Frame creation error: {e}")
+        # Leave a blank frame on error
+        frame.fill(BACKGROUND)
+
+def _add_letter_info(frame: np.ndarray, letter: str, letter_idx: int, total_letters: int):
+    """Draw label, counter and progress bar into the info rows"""
+    try:
+        h, w = frame.shape[:2]
+        
+        # Info rows start blank; the letter image never reaches them
+        top = frame[:INFO_TOP_ROWS]
+        top.fill(BACKGROUND)
+        frame[-INFO_BOTTOM_ROWS:].fill(BACKGROUND)
+        
+        # Letter label
+        _put_text(top, f"Letter: {letter}", (20, 30), 1, (0, 0, 0), 2)
+        
+        # Counter
+        _put_text(top, f"{letter_idx + 1}/{total_letters}", (w - 150, 30), 0.8, (100, 100, 100), 1)
+        
+        # Progress bar
+        progress = (letter_idx + 1) / total_letters
+        bar_width = int((w - 40) * progress)
+        cv2.rectangle(frame, (20, h - 30), (20 + bar_width, h - 10), (0, 200, 0), -1)
+        cv2.rectangle(frame, (20, h - 30), (w - 20, h - 10), (100, 100, 100), 2)
+    
+    except Exception as e:
+        logger.error(f"Info overlay error: {e}")
+
+def _text_patch(text: str, scale: float, color: tuple, thickness: int):
+    """
+    Return cached (patch, mask, dx, dy) for text drawn on the background color
+    (dx, dy) is the patch's top-left corner relative to the text origin
+    """
+    key = (text, scale, color, thickness)
+    patch = _text_cache.get(key)
+    
+    if patch is None:
+        if len(_text_cache) >= TEXT_CACHE_SIZE:
+            _text_cache.clear()
+        
+        (w, h), baseline = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, scale, thickness)
+        pad = max(h, 8) + 2 * thickness
+        canvas = np.full((h + baseline + 2 * pad, w + 2 * pad, 3), BACKGROUND, dtype=np.uint8)
+        cv2.putText(canvas, text, (pad, pad + h), cv2.FONT_HERSHEY_SIMPLEX, scale, color, thickness)
+        
+        # Crop to the pixels the text touched
+        drawn = (canvas != BACKGROUND).any(axis=2)
+        rows = np.flatnonzero(drawn.any(axis=1))
+        cols = np.flatnonzero(drawn.any(axis=0))
+        if rows.size:
+            crop = (slice(rows[0], rows[-1] + 1), slice(cols[0], cols[-1] + 1))
+            patch = (canvas[crop], drawn[crop], int(cols[0]) - pad, int(rows[0]) - pad - h)
+        else:
+            patch = (canvas[:0, :0], drawn[:0, :0], 0, 0)
+        _text_cache[key] = patch
+    
+    return patch
+
+def _put_text(frame: np.ndarray, text: str, org: tuple, scale: float, color: tuple, thickness: int):
+    """Draw text like cv2.putText onto a blank background area, reusing a cached patch"""
+    patch, mask, dx, dy = _text_patch(text, scale, color, thickness)
+    x0, y0 = org[0] + dx, org[1] + dy
+    
+    # Clip to the frame
+    fx0, fy0 = max(x0, 0), max(y0, 0)
+    fx1 = min(x0 + patch.shape[1], frame.shape[1])
+    fy1 = min(y0 + patch.shape[0], frame.shape[0])
+    if fx0 >= fx1 or fy0 >= fy1:
+        return
+    
+    src = (slice(fy0 - y0, fy1 - y0), slice(fx0 - x0, fx1 - x0))
+    region = frame[fy0:fy1, fx0:fx1]
+    region[mask[src]] = patch[src][mask[src]]
+
 class LetterSignGifGenerator:
     """
     Generate GIF by stitching letter sign images
     Takes text input and creates GIF from individual letter images
     """
     
-    def __init__(self, letters_dir: str = "static/letter_signs"):
+    def __init__(self, letters_dir: str = "static/letter_signs", executor: Optional[Executor] = None):
         logger.info("Initializing Letter Sign GIF Generator...")
         
         self.letters_dir = letters_dir
-        self.output_dir = "./"
+        self.output_dir = "/tmp"
         
         # Create directory if it doesn't exist
         os.makedirs(self.letters_dir, exist_ok=True)
         
-        # Load available letter images
-        self.available_letters = self._scan_letter_images()
+        # Where GIF rendering runs; None uses the event loop's default thread pool
+        self.executor = executor
+        
+        # Generation tasks keyed by (text, duration); insertion order = LRU order
+        self._gif_cache = {}
+        self._gif_cache_lock = asyncio.Lock()
+        
+        # Load available letter images and decode them once
+        self.reload_letters()
         
         logger.info(f"Letter Sign Generator initialized with {len(self.available_letters)} letters")
         logger.info(f"Available letters: {sorted(self.available_letters.keys())}")
@@ -38,11 +235,8 @@ class LetterSignGifGenerator:
             logger.warning(f"Letters directory not found: {self.letters_dir}")
             return letters
         
-        # Supported image formats
-        image_extensions = ('.png', '.jpg', '.jpeg', '.gif', '.bmp')
-        
         for filename in os.listdir(self.letters_dir):
-            if filename.lower().endswith(image_extensions):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
                 # Extract letter from filename (e.g., "A.png" -> "A")
                 letter = filename.split('.')[0].upper()
                 
@@ -53,14 +247,123 @@ class LetterSignGifGenerator:
         
         return letters
     
+    def _load_letter_image(self, path: str) -> np.ndarray:
+        """Decode a letter image into an RGB array at the standard height"""
+        letter_img = Image.open(path).convert('RGB')
+        letter_img = self._resize_letter_image(letter_img, target_height=300)
+        return np.array(letter_img)
+    
+    def reload_letters(self):
+        """Rescan the letters directory and decode every image into memory"""
+        self.available_letters = self._scan_letter_images()
+        self.letter_images = {}
+        
+        for letter, path in self.available_letters.items():
+            try:
+                self.letter_images[letter] = self._load_letter_image(path)
+            except Exception as e:
+                logger.error(f"Error loading letter image {letter}: {e}")
+        
+        self._letters_changed()
+    
+    def add_letter_image(self, file_path: str) -> Optional[str]:
+        """Register a single new or replaced letter image without rescanning the directory"""
+        letter = self._register_letter(file_path)
+        if letter is not None:
+            self._letters_changed()
+        return letter
+    
+    async def add_letter_images(self, file_paths: List[str]) -> List[str]:
+        """
+        Register several new or replaced letter images at once
+        Images are decoded on worker threads and derived state is rebuilt once
+        """
+        letters = await asyncio.gather(*(asyncio.to_thread(self._register_letter, path) for path in file_paths))
+        letters = [letter for letter in letters if letter is not None]
+        if letters:
+            self._letters_changed()
+        return letters
+    
+    def _register_letter(self, file_path: str) -> Optional[str]:
+        """Decode one letter image into the in-memory set"""
+        filename = os.path.basename(file_path)
+        if not filename.lower().endswith(IMAGE_EXTENSIONS):
+            return None
+        
+        letter = filename.split('.')[0].upper()
+        self.available_letters[letter] = file_path
+        
+        try:
+            self.letter_images[letter] = self._load_letter_image(file_path)
+        except Exception as e:
+            logger.error(f"Error loading letter image {letter}: {e}")
+            self.letter_images.pop(letter, None)
+        
+        return letter
+    
+    def remove_letter(self, letter: str):
+        """Forget a letter after its image was deleted"""
+        self.available_letters.pop(letter, None)
+        self.letter_images.pop(letter, None)
+        self._letters_changed()
+    
+    def _letters_changed(self):
+        """Rebuild values derived from the letter set; only called on mutation"""
+        self.sorted_letters = tuple(sorted(self.available_letters))
+        self._available_letters_csv = ", ".join(self.sorted_letters)
+        # Drops every character without a letter image (spaces are kept)
+        self.letter_filter = CharFilter(set(self.available_letters) | {" "})
+        # Cached GIFs were built from the old letter images
+        self._gif_cache.clear()
+        self._letters_digest = self._digest_letter_files()
+    
+    def _digest_letter_files(self) -> str:
+        """Fingerprint the letter image files so GIF names change when an image does"""
+        h = hashlib.blake2b(digest_size=16)
+        for letter in self.sorted_letters:
+            path = self.available_letters[letter]
+            try:
+                st = os.stat(path)
+                h.update(f"{letter}:{path}:{st.st_mtime_ns}:{st.st_size};".encode())
+            except OSError:
+                h.update(f"{letter}:{path};".encode())
+        return h.hexdigest()
+    
     async def text_to_gif(self, text: str, duration_per_letter: float = 0.5) -> Dict:
         """
         Convert text to animated GIF by stitching letter images
+        Identical requests share one generation and reuse its GIF
         
         Args:
             text: Text to convert (e.g., "HELLO")
             duration_per_letter: How long each letter displays (seconds)
         """
+        key = (text.upper().strip(), round(duration_per_letter, 3))
+        
+        async with self._gif_cache_lock:
+            task = self._gif_cache.pop(key, None)
+            
+            # Regenerate if the cached file has been removed from disk
+            if task is not None and task.done() and not os.path.exists(task.result().get("gif_path", "")):
+                task = None
+            
+            if task is None:
+                task = asyncio.ensure_future(self._generate_gif(*key))
+                if len(self._gif_cache) >= GIF_CACHE_SIZE:
+                    self._gif_cache.pop(next(iter(self._gif_cache)))
+            self._gif_cache[key] = task
+        
+        # Shielded so a cancelled request doesn't cancel a generation others wait on
+        result = await asyncio.shield(task)
+        
+        # Errors are not cached
+        if "error" in result and self._gif_cache.get(key) is task:
+            del self._gif_cache[key]
+        
+        return result
+    
+    async def _generate_gif(self, text: str, duration_per_letter: float) -> Dict:
+        """Validate text and build its GIF"""
         try:
             logger.info(f"Generating GIF for text: {text}")
             
@@ -78,8 +381,18 @@ class LetterSignGifGenerator:
                     "available": sorted(self.available_letters.keys())
                 }
             
-            # Create GIF
-            gif_path = await self._create_letter_gif(letters, duration_per_letter)
+            # Same text, duration and letter images always map to the same file
+            gif_key = hashlib.blake2b(
+                f"{text}|{duration_per_letter}|{self._letters_digest}".encode(), digest_size=16
+            ).hexdigest()
+            output_path = os.path.join(self.output_dir, f"sign_{gif_key}.gif")
+            
+            if os.path.exists(output_path):
+                logger.info(f"Reusing existing GIF: {output_path}")
+                gif_path = output_path
+            else:
+                # Create GIF
+                gif_path = await self._create_letter_gif(letters, duration_per_letter, output_path)
             
             if not gif_path:
                 return {"error": "Failed to create GIF"}
@@ -90,6 +403,7 @@ class LetterSignGifGenerator:
                 "success": True,
                 "gif_path": gif_path,
                 "filename": os.path.basename(gif_path),
+                "etag": gif_key,
                 "text": text,
                 "letters": letters,
                 "duration": len([l for l in letters if l != ' ']) * duration_per_letter
@@ -99,69 +413,15 @@ class LetterSignGifGenerator:
             logger.error(f"GIF generation error: {e}", exc_info=True)
             return {"error": str(e)}
     
-    async def _create_letter_gif(self, letters: List[str], duration_per_letter: float = 0.5) -> Optional[str]:
+    async def _create_letter_gif(self, letters: List[str], duration_per_letter: float, output_path: str) -> Optional[str]:
         """Create GIF from letter images"""
-        try:
-            filename = f"sign_{datetime.now().strftime('%Y%m%d_%H%M%S')}.gif"
-            output_path = os.path.join(self.output_dir, filename)
-            
-            frames = []
-            fps = 10  # Frames per second
-            frames_per_letter = int(duration_per_letter * fps)
-            
-            for letter_idx, letter in enumerate(letters):
-                if letter == ' ':
-                    # Add blank frame for spaces
-                    blank_frame = np.ones((400, 600, 3), dtype=np.uint8) * 240
-                    self._add_letter_info(blank_frame, letter, letter_idx, len(letters))
-                    for _ in range(frames_per_letter):
-                        frames.append(blank_frame)
-                    continue
-                
-                # Load letter image
-                letter_image_path = self.available_letters.get(letter)
-                
-                if not letter_image_path:
-                    logger.warning(f"No image for letter: {letter}")
-                    continue
-                
-                try:
-                    # Load image
-                    letter_img = Image.open(letter_image_path)
-                    letter_img = letter_img.convert('RGB')
-                    
-                    # Resize to standard size
-                    letter_img = self._resize_letter_image(letter_img, target_height=300)
-                    
-                    # Convert to numpy array
-                    letter_array = np.array(letter_img)
-                    
-                    # Create frame with letter
-                    frame = self._create_letter_frame(letter_array, letter, letter_idx, len(letters))
-                    
-                    # Add frame multiple times for duration
-                    for _ in range(frames_per_letter):
-                        frames.append(frame.copy())
-                    
-                    logger.info(f"Added letter {letter} ({letter_idx + 1}/{len(letters)})")
-                    
-                except Exception as e:
-                    logger.error(f"Error loading letter image {letter}: {e}")
-                    continue
-            
-            # Save as GIF
-            if frames:
-                logger.info(f"Saving GIF with {len(frames)} frames")
-                imageio.mimsave(output_path, frames, fps=fps, loop=0)
-                logger.info(f"GIF created: {output_path} ({len(frames)} frames)")
-                return output_path
-            else:
-                logger.error("No frames created")
-                return None
-            
-        except Exception as e:
-            logger.error(f"GIF creation error: {e}", exc_info=True)
-            return None
+        # Only the images this text uses are sent to the renderer
+        images = {letter: self.letter_images[letter] for letter in set(letters) if letter in self.letter_images}
+        
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, _render_gif, letters, images, duration_per_letter, output_path
+        )
     
     def _resize_letter_image(self, img: Image.Image, target_height: int = 300) -> Image.Image:
         """Resize letter image maintaining aspect ratio"""
@@ -181,71 +441,10 @@ class LetterSignGifGenerator:
             logger.error(f"Resize error: {e}")
             return img
     
-    def _create_letter_frame(self, letter_img: np.ndarray, letter: str, 
-                            letter_idx: int, total_letters: int) -> np.ndarray:
-        """Create frame with letter image"""
-        try:
-            frame_height, frame_width = 400, 600
-            
-            # Create white background
-            frame = np.ones((frame_height, frame_width, 3), dtype=np.uint8) * 240
-            
-            # Get letter image dimensions
-            img_height, img_width = letter_img.shape[:2]
-            
-            # Calculate position to center letter image
-            x_offset = (frame_width - img_width) // 2
-            y_offset = (frame_height - img_height) // 2
-            
-            # Ensure offsets are non-negative
-            x_offset = max(0, x_offset)
-            y_offset = max(0, y_offset)
-            
-            # Place letter image on frame
-            x_end = min(frame_width, x_offset + img_width)
-            y_end = min(frame_height, y_offset + img_height)
-            
-            img_x_end = x_end - x_offset
-            img_y_end = y_end - y_offset
-            
-            frame[y_offset:y_end, x_offset:x_end] = letter_img[:img_y_end, :img_x_end]
-            
-            # Add letter info
-            self._add_letter_info(frame, letter, letter_idx, total_letters)
-            
-            return frame
-            
-        except Exception as e:
-            logger.error(f"Frame creation error: {e}")
-            # Return blank frame on error
-            return np.ones((400, 600, 3), dtype=np.uint8) * 240
-    
-    def _add_letter_info(self, frame: np.ndarray, letter: str, letter_idx: int, total_letters: int):
-        """Add text information to frame"""
-        try:
-            h, w = frame.shape[:2]
-            
-            # Letter label
-            cv2.putText(frame, f"Letter: {letter}", (20, 30),
-                       cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 0), 2)
-            
-            # Counter
-            cv2.putText(frame, f"{letter_idx + 1}/{total_letters}", (w - 150, 30),
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.8, (100, 100, 100), 1)
-            
-            # Progress bar
-            progress = (letter_idx + 1) / total_letters
-            bar_width = int((w - 40) * progress)
-            cv2.rectangle(frame, (20, h - 30), (20 + bar_width, h - 10), (0, 200, 0), -1)
-            cv2.rectangle(frame, (20, h - 30), (w - 20, h - 10), (100, 100, 100), 2)
-            
-        except Exception as e:
-            logger.error(f"Info overlay error: {e}")
-    
     def get_available_letters(self) -> Dict:
         """Get list of available letter images"""
         return {
-            "available": sorted(self.available_letters.keys()),
+            "available": self.sorted_letters,
             "count": len(self.available_letters),
             "directory": self.letters_dir
         }
@@ -258,16 +457,17 @@ class LetterSignGifGenerator:
             
             copied = []
             for filename in os.listdir(images_dir):
-                if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp')):
+                if filename.lower().endswith(IMAGE_EXTENSIONS):
                     source = os.path.join(images_dir, filename)
                     dest = os.path.join(self.letters_dir, filename)
                     
-                    import shutil
                     shutil.copy2(source, dest)
+                    self._register_letter(dest)
                     copied.append(filename)
             
-            # Rescan letters
-            self.available_letters = self._scan_letter_images()
+            # Only the copied images are decoded; the rest stay as loaded
+            if copied:
+                self._letters_changed()
             
             logger.info(f"Copied {len(copied)} letter images")
             
@@ -283,8 +483,6 @@ class LetterSignGifGenerator:
 
 if __name__ == "__main__":
     # Test the LetterSignGifGenerator
-    import asyncio
-    
     async def test():
         generator = LetterSignGifGenerator(letters_dir="/Users/hk/hci/server/static/letter_signs")
         result = await generator.text_to_gif("hello", duration_per_letter=0.5)
@@ -1,28 +1,46 @@
 # server/app/main.py
 import asyncio
+import gzip
+import heapq
 import json
 import logging
+import multiprocessing
 import os
+import shutil
 import tempfile
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, UploadFile, File, Request
-from fastapi.responses import HTMLResponse, FileResponse
+from concurrent.futures import ProcessPoolExecutor
+import orjson
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, UploadFile, File, Request, HTTPException
+from fastapi.responses import HTMLResponse, FileResponse, ORJSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from app.asr import ASRProcessor
+from starlette.datastructures import Headers, MutableHeaders
+from app.asr import ASRProcessor, ASRSession
 from app.letter_sign_gif_generator import LetterSignGifGenerator
 
-logging.basicConfig(level=logging.INFO)
+# LOG_LEVEL=WARNING silences per-request logging in production
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Sign Language Translator", version="1.0.0")
+app = FastAPI(title="Sign Language Translator", version="1.0.0", default_response_class=ORJSONResponse)
 
 # Create static directory
 static_dir = os.path.join(os.path.dirname(__file__), "../static")
+LETTERS_DIR = os.path.join(static_dir, "letter_signs")
+TMP_DIR = "/tmp"
 os.makedirs(static_dir, exist_ok=True)
-os.makedirs(os.path.join(static_dir, "letter_signs"), exist_ok=True)
+os.makedirs(LETTERS_DIR, exist_ok=True)
+
+class GifFiles(StaticFiles):
+    """StaticFiles restricted to generated sign GIFs"""
+    async def get_response(self, path: str, scope):
+        if os.sep in path or not (path.startswith("sign_") and path.endswith(".gif")):
+            raise HTTPException(status_code=404)
+        return await super().get_response(path, scope)
 
 # Mount static files
 app.mount("/static", StaticFiles(directory=static_dir), name="static")
+app.mount("/gif", GifFiles(directory=TMP_DIR), name="gif")
 
 app.add_middleware(
     CORSMiddleware,
@@ -32,16 +50,116 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+class JSONGZipMiddleware:
+    """
+    Gzip JSON responses only
+    Letter images and GIFs are already compressed, so they pass through untouched
+    (keeping Content-Length, Range requests and zero-copy file serving)
+    """
+    def __init__(self, app, minimum_size: int = 512, compresslevel: int = 9):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.compresslevel = compresslevel
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or "gzip" not in Headers(scope=scope).get("accept-encoding", ""):
+            await self.app(scope, receive, send)
+            return
+        
+        start = None
+        body = []
+        
+        async def send_json_gzipped(message):
+            nonlocal start
+            
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                if headers.get("content-type", "").startswith("application/json") and "content-encoding" not in headers:
+                    # Hold the headers until the whole body is known
+                    start = message
+                    return
+            elif start is not None and message["type"] == "http.response.body":
+                body.append(message.get("body", b""))
+                if message.get("more_body", False):
+                    return
+                
+                data = b"".join(body)
+                if len(data) >= self.minimum_size:
+                    data = gzip.compress(data, compresslevel=self.compresslevel)
+                    headers = MutableHeaders(scope=start)
+                    headers["Content-Encoding"] = "gzip"
+                    headers["Content-Length"] = str(len(data))
+                    headers.add_vary_header("Accept-Encoding")
+                
+                await send(start)
+                await send({"type": "http.response.body", "body": data})
+                return
+            
+            await send(message)
+        
+        await self.app(scope, receive, send_json_gzipped)
+
+# Compress larger JSON responses such as /list-gifs
+app.add_middleware(JSONGZipMiddleware, minimum_size=512)
+
 ASR = ASRProcessor()
-GIF_GENERATOR = LetterSignGifGenerator(letters_dir=os.path.join(static_dir, "letter_signs"))
+GIF_GENERATOR = LetterSignGifGenerator(letters_dir=LETTERS_DIR)
+
+# Serializes changes to the in-memory letter set
+_letters_lock = asyncio.Lock()
+
+@app.on_event("startup")
+async def load_asr_model():
+    """Load the Whisper model in the background so the server starts accepting requests right away"""
+    ASR.load_model()
+
+# GIF composition and encoding are CPU-bound; worker processes sidestep the GIL
+GIF_EXECUTOR = None
+
+@app.on_event("startup")
+async def start_gif_executor():
+    """Start the process pool that renders GIFs"""
+    global GIF_EXECUTOR
+    # forkserver: forking this process (ASR thread, ffmpeg readers, OpenMP) can deadlock the child;
+    # workers only need the top-level _render_gif
+    GIF_EXECUTOR = ProcessPoolExecutor(
+        max_workers=os.cpu_count(),
+        mp_context=multiprocessing.get_context("forkserver")
+    )
+    GIF_GENERATOR.executor = GIF_EXECUTOR
+
+@app.on_event("shutdown")
+async def stop_gif_executor():
+    """Stop the GIF worker processes"""
+    if GIF_EXECUTOR is not None:
+        GIF_EXECUTOR.shutdown(cancel_futures=True)
 
 # ==================== WebSocket ====================
+
+async def _consume_audio(session: ASRSession, websocket: WebSocket):
+    """Transcribe audio as the session decoder produces it and send back the events"""
+    while (events := await session.read_stream_events()) is not None:
+        # Send back all events in one frame
+        if events:
+            await websocket.send_text(orjson.dumps(events).decode())
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     """WebSocket endpoint for streaming audio from browser"""
     await websocket.accept()
     logger.info("WebSocket client connected")
     
+    # Each connection gets its own buffer and decoder; only the model is shared
+    session = ASR.session()
+    
+    # One ffmpeg process decodes the whole session
+    await session.start_stream()
+    
+    # Receiving only feeds the decoder; a consumer task transcribes the decoded audio.
+    # Encoded chunks are never dropped since the decoder is stateful; the decoder drops
+    # decoded audio instead when the ASR falls behind
+    consumer = asyncio.create_task(_consume_audio(session, websocket))
+    
     try:
         while True:
             data = await websocket.receive_bytes()
@@ -49,14 +167,10 @@ async def websocket_endpoint(websocket: WebSocket):
             if not data:
                 continue
             
-            logger.info(f"Received {len(data)} bytes")
-            
-            # Accumulate audio chunks
-            events = await ASR.push_audio_chunk_and_get_events(data)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Received {len(data)} bytes")
             
-            # Send back status
-            for event in events:
-                await websocket.send_json(event)
+            await session.feed_stream(data)
             
     except WebSocketDisconnect:
         logger.info("WebSocket client disconnected")
@@ -66,15 +180,23 @@ async def websocket_endpoint(websocket: WebSocket):
             await websocket.close(code=1011, reason=str(e))
         except:
             pass
+    finally:
+        consumer.cancel()
+        await session.stop_stream()
 
 # ==================== Audio & Transcription Endpoints ====================
+UPLOAD_CHUNK_SIZE = 65536
+
+async def _iter_upload(file: UploadFile):
+    """Yield an uploaded file in fixed-size chunks"""
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        yield chunk
 
 @app.post("/transcribe")
 async def transcribe(request: Request):
     """
-    Transcribe audio from either:
-    1. WebSocket accumulated buffer (ASR.audio_buffer)
-    2. POST request body (blob from file upload)
+    Transcribe audio from the POST request body (blob from file upload)
+    Each request is decoded into its own buffer, separate from websocket sessions
     
     Returns: {"text": "...", "gif": {...}}
     """
@@ -82,33 +204,24 @@ async def transcribe(request: Request):
     
     try:
         text = None
-        # Check if body contains audio data
-        body = await request.body()
-        #print(f"Body type: {type(body)}, length: {len(body)}")
         
-        if body and len(body) > 0:
-            logger.info(f"Received audio blob: {len(body)} bytes")
-            
-            # Get content type from headers
-            content_type = request.headers.get("content-type", "audio/webm")
-            logger.info(f"Content-Type: {content_type}")
-            
-            # Decode the audio blob
-            audio_float32 = await ASR._decode_audio(body)
-            
-            # if audio_float32 is None or len(audio_float32) == 0:
-            #     logger.warning("Failed to decode audio blob")
-            #     return {"text": "Failed to decode audio", "gif": None}
-            
-            # Set the audio buffer
-            # ASR.audio_buffer = audio_float32
-            # logger.info(f"Audio buffer set: {len(audio_float32)} samples")
+        # Get content type from headers
+        content_type = request.headers.get("content-type", "audio/webm")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Content-Type: {content_type}")
+        
+        # Decode the body as it arrives, appending PCM to this request's buffer
+        session = ASR.session()
+        samples = await session.append_stream(request.stream(), content_type)
         
+        if samples == 0:
+            logger.warning("Empty or undecodable audio blob")
         
         # Transcribe the accumulated audio
-        text = await ASR.push_audio_chunk_and_get_events(body)
+        text = await session._transcribe_buffer()
         #print(text)
-        logger.info(f"Transcribed: {text}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Transcribed: {text}")
         
         # Generate GIF if text is valid
         gif_result = None
@@ -136,23 +249,15 @@ async def upload_audio(file: UploadFile = File(...)):
     try:
         logger.info(f"Uploading audio file: {file.filename}")
         
-        # Read file
-        content = await file.read()
-        
-        if not content:
-            return {"error": "File is empty"}, 400
+        # Decode while the file is read in chunks, never holding it whole in memory
+        session = ASR.session()
+        samples = await session.append_stream(_iter_upload(file), file.content_type)
         
-        logger.info(f"File size: {len(content)} bytes")
-        
-        # Decode audio
-        audio_float32 = await ASR._decode_audio_chunk(content)
-        
-        if audio_float32 is None or len(audio_float32) == 0:
+        if samples == 0:
             return {"error": "Failed to decode audio file"}, 400
         
-        # Set buffer and transcribe
-        ASR.audio_buffer = audio_float32
-        text = await ASR.transcribe_all()
+        # Transcribe the decoded audio
+        text = await session.transcribe_all()
         
         # Generate GIF
         gif_result = None
@@ -176,7 +281,7 @@ async def upload_audio(file: UploadFile = File(...)):
 # ==================== Text to GIF Endpoints ====================
 
 @app.post("/text-to-gif")
-async def text_to_gif(text: str, duration: float = 0.5):
+async def text_to_gif(request: Request, text: str, duration: float = 0.5):
     """
     Convert text to sign language GIF
     Only uses available letter images, skips missing ones
@@ -201,13 +306,13 @@ async def text_to_gif(text: str, duration: float = 0.5):
         
         # Convert text to uppercase and filter
         text_upper = text.upper()
-        filtered_text = "".join([char for char in text_upper if char in available_letters or char == " "])
+        filtered_text = text_upper.translate(GIF_GENERATOR.letter_filter)
         
         if not filtered_text or filtered_text.strip() == "":
-            missing_letters = set(text_upper) - set(available_letters) - {" "}
+            missing_letters = {c for c in text_upper if c != " " and c not in available_letters}
             return {
                 "success": False, 
-                "error": f"No matching letters found. Missing: {', '.join(sorted(missing_letters))}. Available: {', '.join(sorted(available_letters.keys()))}"
+                "error": f"No matching letters found. Missing: {', '.join(sorted(missing_letters))}. Available: {GIF_GENERATOR._available_letters_csv}"
             }, 400
         
         logger.info(f"Filtered text: '{filtered_text}' (original: '{text}')")
@@ -224,38 +329,27 @@ async def text_to_gif(text: str, duration: float = 0.5):
         if not gif_path or not os.path.exists(gif_path):
             return {"success": False, "error": "GIF file not generated"}, 400
         
+        # GIF names are content hashes, so the client's copy is still valid if the tag matches
+        etag = f'"{result["etag"]}"'
+        cache_headers = {"ETag": etag, "Cache-Control": "public, max-age=86400"}
+        
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers=cache_headers)
+        
         logger.info(f"Serving GIF directly: {gif_path}")
         
         # Return the GIF file directly
         return FileResponse(
             gif_path,
             media_type="image/gif",
-            filename=result.get("filename", "sign_language.gif")
+            filename=result.get("filename", "sign_language.gif"),
+            headers=cache_headers
         )
         
     except Exception as e:
         logger.error(f"GIF generation error: {e}", exc_info=True)
         return {"success": False, "error": str(e)}, 400
 
-@app.get("/gif/{filename}")
-async def get_gif(filename: str):
-    """
-    Serve generated GIF file
-    
-    Path Parameters:
-        filename (str): Name of the GIF file
-    
-    Returns: GIF file with media type image/gif
-    """
-    file_path = os.path.join("/tmp", filename)
-    
-    if not os.path.exists(file_path):
-        logger.warning(f"GIF not found: {file_path}")
-        return {"error": "GIF not found"}, 404
-    
-    logger.info(f"Serving GIF: {file_path}")
-    return FileResponse(file_path, media_type="image/gif", filename=filename)
-
 # ==================== Letter Images Endpoints ====================
 
 @app.get("/available-letters")
@@ -276,6 +370,18 @@ async def get_available_letters():
         logger.error(f"Error getting available letters: {e}")
         return {"error": str(e)}, 400
 
+def _copy_upload(file: UploadFile, file_path: str):
+    """Copy an upload's spooled file to disk in fixed-size chunks"""
+    file.file.seek(0)
+    with open(file_path, "wb") as f:
+        shutil.copyfileobj(file.file, f, UPLOAD_CHUNK_SIZE)
+
+async def _save_letter_upload(file: UploadFile, letters_dir: str) -> str:
+    """Write an uploaded letter image to disk on a worker thread"""
+    file_path = os.path.join(letters_dir, file.filename)
+    await asyncio.to_thread(_copy_upload, file, file_path)
+    return file_path
+
 @app.post("/upload-letters")
 async def upload_letters(files: list[UploadFile] = File(...)):
     """
@@ -292,29 +398,24 @@ async def upload_letters(files: list[UploadFile] = File(...)):
         }
     """
     try:
-        letters_dir = os.path.join(static_dir, "letter_signs")
-        os.makedirs(letters_dir, exist_ok=True)
-        
-        uploaded = []
-        for file in files:
-            if file.filename:
-                file_path = os.path.join(letters_dir, file.filename)
-                content = await file.read()
-                
-                with open(file_path, "wb") as f:
-                    f.write(content)
-                
-                uploaded.append(file.filename)
-                logger.info(f"Uploaded: {file.filename}")
+        files = [file for file in files if file.filename]
+        
+        async with _letters_lock:
+            # Write all files concurrently without blocking the event loop
+            file_paths = await asyncio.gather(*(_save_letter_upload(file, LETTERS_DIR) for file in files))
+            
+            # Update the letter set in place instead of rescanning
+            await GIF_GENERATOR.add_letter_images(file_paths)
         
-        # Rescan letters
-        GIF_GENERATOR.available_letters = GIF_GENERATOR._scan_letter_images()
+        uploaded = [file.filename for file in files]
+        for filename in uploaded:
+            logger.info(f"Uploaded: {filename}")
         
         return {
             "success": True,
             "uploaded": uploaded,
             "total_available": len(GIF_GENERATOR.available_letters),
-            "available": sorted(GIF_GENERATOR.available_letters.keys())
+            "available": GIF_GENERATOR.sorted_letters
         }
         
     except Exception as e:
@@ -334,14 +435,14 @@ async def delete_letter(letter: str):
     try:
         letter = letter.upper()
         
-        if letter not in GIF_GENERATOR.available_letters:
-            return {"error": f"Letter {letter} not found"}, 404
-        
-        file_path = GIF_GENERATOR.available_letters[letter]
-        os.remove(file_path)
-        
-        # Rescan
-        GIF_GENERATOR.available_letters = GIF_GENERATOR._scan_letter_images()
+        async with _letters_lock:
+            if letter not in GIF_GENERATOR.available_letters:
+                return {"error": f"Letter {letter} not found"}, 404
+            
+            file_path = GIF_GENERATOR.available_letters[letter]
+            os.remove(file_path)
+            
+            GIF_GENERATOR.remove_letter(letter)
         
         logger.info(f"Deleted letter: {letter}")
         
@@ -349,13 +450,35 @@ async def delete_letter(letter: str):
             "success": True,
             "deleted": letter,
             "remaining": len(GIF_GENERATOR.available_letters),
-            "available": sorted(GIF_GENERATOR.available_letters.keys())
+            "available": GIF_GENERATOR.sorted_letters
         }
         
     except Exception as e:
         logger.error(f"Delete error: {e}")
         return {"error": str(e)}, 400
 
+@app.post("/rescan-letters")
+async def rescan_letters():
+    """
+    Rescan the letters directory from disk
+    Only needed when images were changed outside the API
+    
+    Returns: {"success": true, "total_available": 26, "available": [...]}
+    """
+    try:
+        async with _letters_lock:
+            GIF_GENERATOR.reload_letters()
+        
+        return {
+            "success": True,
+            "total_available": len(GIF_GENERATOR.available_letters),
+            "available": GIF_GENERATOR.sorted_letters
+        }
+        
+    except Exception as e:
+        logger.error(f"Rescan error: {e}", exc_info=True)
+        return {"error": str(e)}, 400
+
 # ==================== Batch Operations ====================
 
 @app.post("/batch-text-to-gif")
@@ -387,14 +510,18 @@ async def batch_text_to_gif(request_body: dict):
         if not texts or len(texts) == 0:
             return {"error": "No texts provided"}, 400
         
-        results = []
+        # Generate concurrently, bounded to one job per core
+        semaphore = asyncio.Semaphore(os.cpu_count() or 4)
         
-        for text in texts:
-            result = await GIF_GENERATOR.text_to_gif(text, duration_per_letter=duration)
-            results.append({
+        async def generate(text):
+            async with semaphore:
+                result = await GIF_GENERATOR.text_to_gif(text, duration_per_letter=duration)
+            return {
                 "text": text,
                 **result
-            })
+            }
+        
+        results = await asyncio.gather(*(generate(text) for text in texts))
         
         return {
             "success": True,
@@ -425,16 +552,16 @@ async def get_stats():
         
         # Count GIFs in temp directory
         gifs_count = 0
-        if os.path.exists("/tmp"):
-            gifs_count = len([f for f in os.listdir("/tmp") if f.startswith("sign_") and f.endswith(".gif")])
+        if os.path.exists(TMP_DIR):
+            gifs_count = sum(1 for e in os.scandir(TMP_DIR) if e.name.startswith("sign_") and e.name.endswith(".gif"))
         
         return {
             "available_letters": letters_count,
-            "available_letters_list": sorted(GIF_GENERATOR.available_letters.keys()),
+            "available_letters_list": GIF_GENERATOR.sorted_letters,
             "total_gifs_generated": gifs_count,
             "server_status": "running",
-            "storage_dir": "/tmp",
-            "letters_dir": os.path.join(static_dir, "letter_signs"),
+            "storage_dir": TMP_DIR,
+            "letters_dir": LETTERS_DIR,
             "version": "1.0.0"
         }
         
@@ -459,30 +586,24 @@ async def list_gifs(limit: int = 10):
         }
     """
     try:
-        gifs = []
-        
-        if os.path.exists("/tmp"):
-            files = [
-                f for f in os.listdir("/tmp") 
-                if f.startswith("sign_") and f.endswith(".gif")
-            ]
-            
-            # Sort by modification time (newest first)
-            files.sort(
-                key=lambda f: os.path.getmtime(os.path.join("/tmp", f)),
-                reverse=True
-            )
-            
-            for filename in files[:limit]:
-                file_path = os.path.join("/tmp", filename)
-                stat = os.stat(file_path)
-                
-                gifs.append({
-                    "filename": filename,
-                    "size": stat.st_size,
-                    "created": stat.st_mtime,
-                    "url": f"/gif/{filename}"
-                })
+        try:
+            with os.scandir(TMP_DIR) as it:
+                entries = [e for e in it if e.name.startswith("sign_") and e.name.endswith(".gif")]
+        except FileNotFoundError:
+            entries = []
+        
+        # Newest first; only the top `limit` are kept, DirEntry caches each stat
+        newest = heapq.nlargest(limit, entries, key=lambda e: e.stat().st_mtime)
+        
+        gifs = [
+            {
+                "filename": e.name,
+                "size": e.stat().st_size,
+                "created": e.stat().st_mtime,
+                "url": f"/gif/{e.name}"
+            }
+            for e in newest
+        ]
         
         return {
             "count": len(gifs),
@@ -507,7 +628,7 @@ async def health():
         return {
             "status": "ok",
             "service": "Sign Language Translator",
-            "asr": "ready",
+            "asr": "ready" if ASR.model_ready else "loading",
             "gif_generator": "ready",
             "available_letters": letters,
             "version": "1.0.0"
@@ -518,15 +639,10 @@ async def health():
             "error": str(e)
         }, 500
 
-@app.get("/test")
-async def test_page():
-    """Serve interactive test page"""
-    try:
-        with open("test_audio.html", "r") as f:
-            return HTMLResponse(f.read())
-    except FileNotFoundError:
-        logger.error("test_audio.html not found")
-        return HTMLResponse("""
+# Pages are static, so they are encoded once instead of per request
+TEST_PAGE_PATH = "test_audio.html"
+
+TEST_PAGE_NOT_FOUND_HTML = """
         <html>
         <body style="font-family: sans-serif; max-width: 800px; margin: 50px auto;">
             <h1>❌ Test Page Not Found</h1>
@@ -542,12 +658,9 @@ async def test_page():
             </ul>
         </body>
         </html>
-        """, status_code=404)
+        """.encode("utf-8")
 
-@app.get("/")
-async def root():
-    """Root endpoint with API documentation"""
-    docs = """
+ROOT_HTML = """
     <!DOCTYPE html>
     <html>
     <head>
@@ -656,6 +769,11 @@ async def root():
                 <p>Delete a letter image</p>
             </div>
             
+            <div class="endpoint">
+                <span class="method">POST</span> <code>/rescan-letters</code>
+                <p>Reload letter images from disk</p>
+            </div>
+            
             <h2>⚙️ Batch Operations</h2>
             
             <div class="endpoint">
@@ -682,8 +800,31 @@ async def root():
         </div>
     </body>
     </html>
-    """
-    return HTMLResponse(docs)
+    """.encode("utf-8")
+
+_test_page = None
+
+@app.on_event("startup")
+async def load_test_page():
+    """Read the interactive test page into memory"""
+    global _test_page
+    try:
+        with open(TEST_PAGE_PATH, "rb") as f:
+            _test_page = f.read()
+    except FileNotFoundError:
+        logger.error(f"{TEST_PAGE_PATH} not found")
+
+@app.get("/test", response_class=HTMLResponse)
+async def test_page():
+    """Serve interactive test page"""
+    if _test_page is None:
+        return Response(content=TEST_PAGE_NOT_FOUND_HTML, media_type="text/html", status_code=404)
+    return Response(content=_test_page, media_type="text/html")
+
+@app.get("/", response_class=HTMLResponse)
+async def root():
+    """Root endpoint with API documentation"""
+    return Response(content=ROOT_HTML, media_type="text/html")
 
 # ==================== 404 Handler ====================
 @app.get("/.well-known/appspecific/com.chrome.devtools.json")
@@ -1,13 +1,357 @@
+import asyncio
+import functools
+import hashlib
 import logging
+import math
 import os
-import imageio
+import uuid
 import numpy as np
-from typing import List, Dict, Optional
-from datetime import datetime
+from typing import Callable, List, Dict, Iterable, Iterator, Optional, Tuple
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import cv2
+from PIL import Image
 
 logger = logging.getLogger(__name__)
 
+# Hand geometry; fingers are 5 equally spaced spokes from the palm center
+HAND_RADIUS = 20
+FINGER_LENGTH = 15
+FINGER_ANGLES = (0, 72, 144, 216, 288)
+
+# Fingertip offsets from the palm center, computed once
+# floor() matches the old int(hand + offset) for the positive coordinates used
+FINGER_OFFSETS = tuple(
+    (math.floor((HAND_RADIUS + FINGER_LENGTH) * math.cos(math.radians(angle))),
+     math.floor((HAND_RADIUS + FINGER_LENGTH) * math.sin(math.radians(angle))))
+    for angle in FINGER_ANGLES
+)
+
+# GIF palette: every grey the drawing produces (background, outlines, anti-aliased
+# text) plus the skin, palm and torso colors
+PALETTE_GREYS = 246
+GIF_PALETTE = np.array(
+    [(g, g, g) for g in range(PALETTE_GREYS)] + [(220, 180, 160), (200, 150, 120), (0, 0, 255)],
+    dtype=np.uint8
+)
+
+def _build_palette_lut() -> np.ndarray:
+    """Nearest palette index for every 15-bit (5 bits per channel) color"""
+    keys = np.arange(1 << 15)
+    centers = np.stack([(keys >> 10) & 31, (keys >> 5) & 31, keys & 31], axis=1) * 8 + 4
+    
+    best = np.zeros(len(keys), dtype=np.uint8)
+    best_dist = np.full(len(keys), np.iinfo(np.int32).max, dtype=np.int32)
+    for idx, color in enumerate(GIF_PALETTE.astype(np.int32)):
+        dist = ((centers - color) ** 2).sum(axis=1)
+        closer = dist < best_dist
+        best[closer] = idx
+        best_dist[closer] = dist[closer]
+    return best
+
+_PALETTE_LUT = _build_palette_lut()
+_PALETTE_BYTES = GIF_PALETTE.tobytes()
+
+def _to_palette_image(frame: np.ndarray) -> Image.Image:
+    """Convert an RGB frame to a P-mode image on GIF_PALETTE"""
+    r, g, b = frame[..., 0], frame[..., 1], frame[..., 2]
+    
+    # Greys index the palette directly; anything else goes through the 15-bit LUT
+    grey = (r == g) & (g == b) & (r < PALETTE_GREYS)
+    key = ((r >> 3).astype(np.uint16) << 10) | ((g >> 3).astype(np.uint16) << 5) | (b >> 3)
+    indices = np.where(grey, r, _PALETTE_LUT[key]).astype(np.uint8)
+    
+    image = Image.fromarray(indices, mode="P")
+    image.putpalette(_PALETTE_BYTES)
+    return image
+
+# (5, 2, 2) palm-to-fingertip segments relative to the palm center, for cv2.polylines
+_FINGER_SPOKES = np.array([[(0, 0), offset] for offset in FINGER_OFFSETS], dtype=np.int32)
+
+def _build_hand_sprite():
+    """
+    Return (patch, mask, dx, dy) for the hand drawn around the origin
+    The hand only ever moves by whole pixels, so its drawing is the same everywhere
+    """
+    pad = HAND_RADIUS + FINGER_LENGTH + 8
+    size = 2 * pad + 1
+    # Black never appears in the hand, so it marks untouched pixels
+    canvas = np.zeros((size, size, 3), dtype=np.uint8)
+    
+    # Hand shape circle
+    cv2.circle(canvas, (pad, pad), HAND_RADIUS, (220, 180, 160), -1)
+    cv2.circle(canvas, (pad, pad), HAND_RADIUS, (100, 100, 100), 2)
+    
+    # Fingers (simplified)
+    spokes = _FINGER_SPOKES + np.array([pad, pad], dtype=np.int32)
+    cv2.polylines(canvas, spokes, False, (100, 100, 100), 2)
+    for end_x, end_y in spokes[:, 1].tolist():
+        cv2.circle(canvas, (end_x, end_y), 3, (100, 100, 100), -1)
+    
+    # Palm details
+    cv2.circle(canvas, (pad, pad), 8, (200, 150, 120), -1)
+    
+    # Crop to the pixels the hand touched
+    drawn = canvas.any(axis=2)
+    rows = np.flatnonzero(drawn.any(axis=1))
+    cols = np.flatnonzero(drawn.any(axis=0))
+    crop = (slice(rows[0], rows[-1] + 1), slice(cols[0], cols[-1] + 1))
+    return canvas[crop], drawn[crop], int(cols[0]) - pad, int(rows[0]) - pad
+
+_HAND_SPRITE = _build_hand_sprite()
+
+def _stamp(frame: np.ndarray, patch: np.ndarray, mask: np.ndarray, x0: int, y0: int):
+    """Copy the masked pixels of `patch` onto `frame` with its top-left corner at (x0, y0)"""
+    # Clip to the frame
+    fx0, fy0 = max(x0, 0), max(y0, 0)
+    fx1 = min(x0 + patch.shape[1], frame.shape[1])
+    fy1 = min(y0 + patch.shape[0], frame.shape[0])
+    if fx0 >= fx1 or fy0 >= fy1:
+        return
+    
+    src = (slice(fy0 - y0, fy1 - y0), slice(fx0 - x0, fx1 - x0))
+    region = frame[fy0:fy1, fx0:fx1]
+    region[mask[src]] = patch[src][mask[src]]
+
+def _to_positions(x, y) -> List[tuple]:
+    """Zip x/y coordinate arrays (or scalars) into a list of int (x, y) tuples"""
+    x, y = np.broadcast_arrays(x, y)
+    return list(zip(x.tolist(), y.tolist()))
+
+def _run_lengths(positions: List[tuple]):
+    """Collapse consecutive equal positions into (positions, repeat counts)"""
+    runs, repeats = [], []
+    for pos in positions:
+        if runs and runs[-1] == pos:
+            repeats[-1] += 1
+        else:
+            runs.append(pos)
+            repeats.append(1)
+    return runs, repeats
+
+# Position generators for different hand movements
+# Each computes all frames at once; astype(int) truncates like int()
+def _generate_wave_positions() -> List[tuple]:
+    """Generate positions for waving gesture"""
+    i = np.arange(15)
+    x = 300 + (30 * np.sin(i * np.pi / 7.5)).astype(int)
+    y = 200 - (20 * np.cos(i * np.pi / 7.5)).astype(int)
+    return _to_positions(x, y)
+
+def _generate_circle_positions() -> List[tuple]:
+    """Generate positions for circular motion"""
+    angle = np.arange(15) * (2 * np.pi / 15)
+    x = 300 + (40 * np.cos(angle)).astype(int)
+    y = 250 + (40 * np.sin(angle)).astype(int)
+    return _to_positions(x, y)
+
+def _generate_point_positions() -> List[tuple]:
+    """Generate positions for pointing"""
+    t = np.arange(10) / 10
+    x = 300 + (60 * t).astype(int)
+    y = 250 - (30 * t).astype(int)
+    return _to_positions(x, y)
+
+def _generate_thank_positions() -> List[tuple]:
+    """Generate positions for thank you"""
+    i = np.arange(12)
+    y = 250 - (40 * np.sin(i * np.pi / 12)).astype(int)
+    return _to_positions(300, y)
+
+def _generate_thumbs_up_positions() -> List[tuple]:
+    """Generate positions for thumbs up"""
+    t = np.arange(10) / 10
+    y = 300 - (50 * t).astype(int)
+    return _to_positions(300, y)
+
+def _generate_nod_positions() -> List[tuple]:
+    """Generate positions for nodding"""
+    i = np.arange(10)
+    y = 250 + (30 * np.sin(i * np.pi / 5)).astype(int)
+    return _to_positions(300, y)
+
+def _generate_shake_positions() -> List[tuple]:
+    """Generate positions for shaking"""
+    i = np.arange(12)
+    x = 300 + (40 * np.cos(i * np.pi / 6)).astype(int)
+    return _to_positions(x, 250)
+
+def _generate_down_positions() -> List[tuple]:
+    """Generate positions for moving down"""
+    t = np.arange(12) / 12
+    y = 200 + (100 * t).astype(int)
+    return _to_positions(300, y)
+
+def _generate_lift_positions() -> List[tuple]:
+    """Generate positions for lifting"""
+    t = np.arange(12) / 12
+    y = 350 - (100 * t).astype(int)
+    return _to_positions(300, y)
+
+def _generate_heart_positions() -> List[tuple]:
+    """Generate positions for heart shape"""
+    angle = np.arange(12) * (2 * np.pi / 12)
+    x = 300 + (50 * np.cos(angle)).astype(int)
+    y = 250 + (50 * np.sin(angle)).astype(int)
+    return _to_positions(x, y)
+
+def _generate_cross_positions() -> List[tuple]:
+    """Generate positions for crossing"""
+    t = np.arange(10) / 10
+    x = 250 + (100 * t).astype(int)
+    y = 200 + (100 * t).astype(int)
+    return _to_positions(x, y)
+
+def _generate_shrug_positions() -> List[tuple]:
+    """Generate positions for shrugging"""
+    i = np.arange(12)
+    x = 280 + (40 * np.sin(i * np.pi / 6)).astype(int)
+    y = 250 - (30 * np.cos(i * np.pi / 6)).astype(int)
+    return _to_positions(x, y)
+
+def _build_sign_db() -> Dict[str, Dict]:
+    """Build the sign-to-hand-pose mappings"""
+    return {
+        "hello": {
+            "frames": 15,
+            "hand_positions": _generate_wave_positions(),
+            "description": "Wave hand"
+        },
+        "hi": {
+            "frames": 12,
+            "hand_positions": _generate_wave_positions(),
+            "description": "Quick wave"
+        },
+        "how": {
+            "frames": 15,
+            "hand_positions": _generate_circle_positions(),
+            "description": "Circular motion"
+        },
+        "are": {
+            "frames": 10,
+            "hand_positions": _generate_point_positions(),
+            "description": "Point outward"
+        },
+        "you": {
+            "frames": 10,
+            "hand_positions": _generate_point_positions(),
+            "description": "Point to you"
+        },
+        "thank": {
+            "frames": 12,
+            "hand_positions": _generate_thank_positions(),
+            "description": "Hand to chest"
+        },
+        "thanks": {
+            "frames": 12,
+            "hand_positions": _generate_thank_positions(),
+            "description": "Hand to chest"
+        },
+        "good": {
+            "frames": 10,
+            "hand_positions": _generate_thumbs_up_positions(),
+            "description": "Thumbs up"
+        },
+        "yes": {
+            "frames": 10,
+            "hand_positions": _generate_nod_positions(),
+            "description": "Nod motion"
+        },
+        "no": {
+            "frames": 12,
+            "hand_positions": _generate_shake_positions(),
+            "description": "Shake motion"
+        },
+        "water": {
+            "frames": 12,
+            "hand_positions": _generate_down_positions(),
+            "description": "Move downward"
+        },
+        "help": {
+            "frames": 12,
+            "hand_positions": _generate_lift_positions(),
+            "description": "Hands lifting"
+        },
+        "love": {
+            "frames": 12,
+            "hand_positions": _generate_heart_positions(),
+            "description": "Heart shape"
+        },
+        "name": {
+            "frames": 10,
+            "hand_positions": _generate_cross_positions(),
+            "description": "Crossing motion"
+        },
+        "what": {
+            "frames": 12,
+            "hand_positions": _generate_shrug_positions(),
+            "description": "Shrug motion"
+        },
+    }
+
+# Sign poses are constant, so they are computed once at import
+_SIGN_DB = _build_sign_db()
+
+# Supported outputs; MP4 codecs are tried in order
+OUTPUT_FORMATS = ("gif", "mp4")
+MP4_CODECS = ("avc1", "mp4v")
+
+# Words without a sign that are dropped instead of shown as a placeholder
+STOPWORDS = frozenset({"the", "a", "an", "is", "and", "or", "in", "on", "at"})
+
+# Punctuation stripped from the ends of each word
+WORD_PUNCTUATION = '.,!?;:\'"'
+
+# Frames are drawn at 600x500 and area-averaged down to this size before encoding
+OUTPUT_SIZE = (300, 250)
+
+# Shared pool for rendering signs of a GIF in parallel
+_RENDER_POOL = ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1))
+
+# Signs rendered ahead of the encoder; bounds how many frames are held in memory
+RENDER_AHEAD = 4
+
+# Rendered text patches keyed by (text, scale, color, thickness, background)
+TEXT_SPRITE_CACHE_SIZE = 512
+_text_sprites = {}
+
+def _text_sprite(text: str, scale: float, color: tuple, thickness: int, background: int):
+    """
+    Return (patch, mask, dx, dy) for text drawn with FONT_HERSHEY_SIMPLEX on a flat background
+    (dx, dy) is the patch's top-left corner relative to the text origin
+    Whole strings are cached so glyph spacing and anti-aliasing match cv2.putText exactly
+    """
+    key = (text, scale, color, thickness, background)
+    sprite = _text_sprites.get(key)
+    
+    if sprite is None:
+        if len(_text_sprites) >= TEXT_SPRITE_CACHE_SIZE:
+            _text_sprites.clear()
+        
+        (w, h), baseline = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, scale, thickness)
+        pad = max(h, 8) + 2 * thickness
+        canvas = np.full((h + baseline + 2 * pad, w + 2 * pad, 3), background, dtype=np.uint8)
+        cv2.putText(canvas, text, (pad, pad + h), cv2.FONT_HERSHEY_SIMPLEX, scale, color, thickness)
+        
+        # Crop to the pixels the text touched
+        drawn = (canvas != background).any(axis=2)
+        rows = np.flatnonzero(drawn.any(axis=1))
+        cols = np.flatnonzero(drawn.any(axis=0))
+        if rows.size:
+            crop = (slice(rows[0], rows[-1] + 1), slice(cols[0], cols[-1] + 1))
+            sprite = (canvas[crop], drawn[crop], cols[0] - pad, rows[0] - pad - h)
+        else:
+            sprite = (canvas[:0, :0], drawn[:0, :0], 0, 0)
+        _text_sprites[key] = sprite
+    
+    return sprite
+
+def _blit_text(frame: np.ndarray, text: str, org: tuple, scale: float, color: tuple, thickness: int,
+               background: int = 245):
+    """Draw text like cv2.putText onto a flat `background` area, reusing a cached patch"""
+    patch, mask, dx, dy = _text_sprite(text, scale, color, thickness, background)
+    _stamp(frame, patch, mask, org[0] + dx, org[1] + dy)
+
 class SignLanguageGifGenerator:
     """
     Generate animated GIF of sign language from text
@@ -17,210 +361,26 @@ class SignLanguageGifGenerator:
     def __init__(self):
         logger.info("Initializing Sign Language GIF Generator...")
         
-        # Sign database with keyframe positions
-        self.sign_database = self._load_sign_poses()
+        # Sign database with keyframe positions (shared, read-only)
+        self.sign_database = _SIGN_DB
         self.output_dir = "/tmp"
         
+        # Per-sign renderers with the pose baked in, built on first use
+        self._sign_renderers: Dict[str, Tuple[Callable, List[int]]] = {}
+        
         logger.info("Sign Language GIF Generator initialized")
     
-    def _load_sign_poses(self) -> Dict[str, Dict]:
-        """Load sign-to-hand-pose mappings"""
-        return {
-            "hello": {
-                "frames": 15,
-                "hand_positions": self._generate_wave_positions(),
-                "description": "Wave hand"
-            },
-            "hi": {
-                "frames": 12,
-                "hand_positions": self._generate_wave_positions(),
-                "description": "Quick wave"
-            },
-            "how": {
-                "frames": 15,
-                "hand_positions": self._generate_circle_positions(),
-                "description": "Circular motion"
-            },
-            "are": {
-                "frames": 10,
-                "hand_positions": self._generate_point_positions(),
-                "description": "Point outward"
-            },
-            "you": {
-                "frames": 10,
-                "hand_positions": self._generate_point_positions(),
-                "description": "Point to you"
-            },
-            "thank": {
-                "frames": 12,
-                "hand_positions": self._generate_thank_positions(),
-                "description": "Hand to chest"
-            },
-            "thanks": {
-                "frames": 12,
-                "hand_positions": self._generate_thank_positions(),
-                "description": "Hand to chest"
-            },
-            "good": {
-                "frames": 10,
-                "hand_positions": self._generate_thumbs_up_positions(),
-                "description": "Thumbs up"
-            },
-            "yes": {
-                "frames": 10,
-                "hand_positions": self._generate_nod_positions(),
-                "description": "Nod motion"
-            },
-            "no": {
-                "frames": 12,
-                "hand_positions": self._generate_shake_positions(),
-                "description": "Shake motion"
-            },
-            "water": {
-                "frames": 12,
-                "hand_positions": self._generate_down_positions(),
-                "description": "Move downward"
-            },
-            "help": {
-                "frames": 12,
-                "hand_positions": self._generate_lift_positions(),
-                "description": "Hands lifting"
-            },
-            "love": {
-                "frames": 12,
-                "hand_positions": self._generate_heart_positions(),
-                "description": "Heart shape"
-            },
-            "name": {
-                "frames": 10,
-                "hand_positions": self._generate_cross_positions(),
-                "description": "Crossing motion"
-            },
-            "what": {
-                "frames": 12,
-                "hand_positions": self._generate_shrug_positions(),
-                "description": "Shrug motion"
-            },
-        }
-    
-    # Position generators for different hand movements
-    def _generate_wave_positions(self) -> List[tuple]:
-        """Generate positions for waving gesture"""
-        positions = []
-        for i in range(15):
-            x = 300 + int(30 * np.sin(i * np.pi / 7.5))
-            y = 200 - int(20 * np.cos(i * np.pi / 7.5))
-            positions.append((x, y))
-        return positions
-    
-    def _generate_circle_positions(self) -> List[tuple]:
-        """Generate positions for circular motion"""
-        positions = []
-        for i in range(15):
-            angle = i * (2 * np.pi / 15)
-            x = 300 + int(40 * np.cos(angle))
-            y = 250 + int(40 * np.sin(angle))
-            positions.append((x, y))
-        return positions
-    
-    def _generate_point_positions(self) -> List[tuple]:
-        """Generate positions for pointing"""
-        positions = []
-        for i in range(10):
-            x = 300 + int(60 * (i / 10))
-            y = 250 - int(30 * (i / 10))
-            positions.append((x, y))
-        return positions
-    
-    def _generate_thank_positions(self) -> List[tuple]:
-        """Generate positions for thank you"""
-        positions = []
-        for i in range(12):
-            x = 300
-            y = 250 - int(40 * np.sin(i * np.pi / 12))
-            positions.append((x, y))
-        return positions
-    
-    def _generate_thumbs_up_positions(self) -> List[tuple]:
-        """Generate positions for thumbs up"""
-        positions = []
-        for i in range(10):
-            x = 300
-            y = 300 - int(50 * (i / 10))
-            positions.append((x, y))
-        return positions
-    
-    def _generate_nod_positions(self) -> List[tuple]:
-        """Generate positions for nodding"""
-        positions = []
-        for i in range(10):
-            x = 300
-            y = 250 + int(30 * np.sin(i * np.pi / 5))
-            positions.append((x, y))
-        return positions
-    
-    def _generate_shake_positions(self) -> List[tuple]:
-        """Generate positions for shaking"""
-        positions = []
-        for i in range(12):
-            x = 300 + int(40 * np.cos(i * np.pi / 6))
-            y = 250
-            positions.append((x, y))
-        return positions
-    
-    def _generate_down_positions(self) -> List[tuple]:
-        """Generate positions for moving down"""
-        positions = []
-        for i in range(12):
-            x = 300
-            y = 200 + int(100 * (i / 12))
-            positions.append((x, y))
-        return positions
-    
-    def _generate_lift_positions(self) -> List[tuple]:
-        """Generate positions for lifting"""
-        positions = []
-        for i in range(12):
-            x = 300
-            y = 350 - int(100 * (i / 12))
-            positions.append((x, y))
-        return positions
-    
-    def _generate_heart_positions(self) -> List[tuple]:
-        """Generate positions for heart shape"""
-        positions = []
-        for i in range(12):
-            angle = i * (2 * np.pi / 12)
-            x = 300 + int(50 * np.cos(angle))
-            y = 250 + int(50 * np.sin(angle))
-            positions.append((x, y))
-        return positions
-    
-    def _generate_cross_positions(self) -> List[tuple]:
-        """Generate positions for crossing"""
-        positions = []
-        for i in range(10):
-            x = 250 + int(100 * (i / 10))
-            y = 200 + int(100 * (i / 10))
-            positions.append((x, y))
-        return positions
-    
-    def _generate_shrug_positions(self) -> List[tuple]:
-        """Generate positions for shrugging"""
-        positions = []
-        for i in range(12):
-            x = 280 + int(40 * np.sin(i * np.pi / 6))
-            y = 250 - int(30 * np.cos(i * np.pi / 6))
-            positions.append((x, y))
-        return positions
-    
-    async def text_to_gif(self, text: str) -> Dict:
+    async def text_to_gif(self, text: str, output_format: str = "gif") -> Dict:
         """
         Convert text to animated sign language GIF
+        output_format "mp4" writes a video instead, which is smaller and faster to encode
         """
         try:
             logger.info(f"Generating GIF for text: {text}")
             
+            if output_format not in OUTPUT_FORMATS:
+                return {"error": f"Unsupported output format: {output_format}"}
+            
             # Convert text to signs
             signs = self._text_to_signs(text)
             
@@ -229,8 +389,18 @@ class SignLanguageGifGenerator:
             
             logger.info(f"Sign sequence: {signs}")
             
-            # Generate GIF
-            gif_path = await self._create_gif(signs)
+            # Same signs, format and size always render the same file
+            gif_key = hashlib.blake2b(
+                f"{'|'.join(signs)}|{output_format}|{OUTPUT_SIZE}".encode(), digest_size=8
+            ).hexdigest()
+            output_path = os.path.join(self.output_dir, f"sign_{gif_key}.{output_format}")
+            
+            if os.path.exists(output_path):
+                logger.info(f"Reusing existing {output_format.upper()}: {output_path}")
+                gif_path = output_path
+            else:
+                # Generate GIF
+                gif_path = await self._create_gif(signs, output_format, output_path)
             
             if not gif_path:
                 return {"error": "Failed to create GIF"}
@@ -239,6 +409,8 @@ class SignLanguageGifGenerator:
                 "success": True,
                 "gif_path": gif_path,
                 "filename": os.path.basename(gif_path),
+                "etag": gif_key,
+                "format": output_format,
                 "text": text,
                 "signs": signs,
                 "duration": len(signs) * 1.0
@@ -255,14 +427,14 @@ class SignLanguageGifGenerator:
             signs = []
             
             for word in words:
-                clean_word = word.strip('.,!?;:\'"')
+                clean_word = word.strip(WORD_PUNCTUATION)
                 
                 if clean_word in self.sign_database:
                     signs.append(clean_word)
                 else:
                     logger.warning(f"No sign for '{clean_word}'")
                     # Try to use as-is or skip
-                    if clean_word in ["the", "a", "an", "is", "and", "or", "in", "on", "at"]:
+                    if clean_word in STOPWORDS:
                         # Skip common words
                         continue
                     signs.append(clean_word)
@@ -273,64 +445,196 @@ class SignLanguageGifGenerator:
             logger.error(f"Text to signs error: {e}")
             return []
     
-    async def _create_gif(self, signs: List[str]) -> Optional[str]:
-        """Create animated GIF from signs"""
+    async def _create_gif(self, signs: List[str], output_format: str, output_path: str) -> Optional[str]:
+        """Create animated GIF from signs on a worker thread, keeping the event loop free"""
+        return await asyncio.to_thread(self._create_gif_sync, signs, output_format, output_path)
+    
+    def _create_gif_sync(self, signs: List[str], output_format: str, output_path: str) -> Optional[str]:
+        """Render and encode the GIF (CPU-bound)"""
+        # Write to a unique temp name first so a half-written file is never served,
+        # and concurrent renders of the same signs don't write into each other.
+        # Temp names never match sign_*.gif; MP4 keeps its extension for cv2.VideoWriter
+        tmp_id = uuid.uuid4().hex[:8]
+        if output_format == "mp4":
+            tmp_path = os.path.join(self.output_dir, f"tmp_{tmp_id}_{os.path.basename(output_path)}")
+        else:
+            tmp_path = f"{output_path}.{tmp_id}.tmp"
+        
         try:
-            filename = f"sign_{datetime.now().strftime('%Y%m%d_%H%M%S')}.gif"
-            output_path = os.path.join(self.output_dir, filename)
             
             # Video properties
             width, height = 600, 500
             fps = 10
             
-            frames = []
+            # Background and avatar body never change, so draw them once
+            bg_template = np.full((height, width, 3), 245, dtype=np.uint8)
+            self._draw_body(bg_template, 300, 300)
             
-            for sign_idx, sign in enumerate(signs):
-                sign_info = self.sign_database.get(sign, {
-                    "frames": 10,
-                    "hand_positions": [(300, 250)] * 10,
-                    "description": sign
-                })
-                
-                positions = sign_info["hand_positions"]
-                
-                # Create frames for this sign
-                for frame_idx, (hand_x, hand_y) in enumerate(positions):
-                    frame = np.ones((height, width, 3), dtype=np.uint8) * 240
-                    
-                    # Draw background
-                    cv2.rectangle(frame, (0, 0), (width, height), (245, 245, 245), -1)
-                    
-                    # Draw body
-                    self._draw_body(frame, 300, 300)
-                    
-                    # Draw animated hand
-                    self._draw_hand(frame, hand_x, hand_y, sign)
-                    
-                    # Draw sign info
-                    cv2.putText(frame, f"Sign: {sign.upper()}", (20, 40),
-                               cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 0), 2)
-                    cv2.putText(frame, sign_info["description"], (20, 70),
-                               cv2.FONT_HERSHEY_SIMPLEX, 0.7, (100, 100, 100), 1)
-                    
-                    # Draw counter
-                    cv2.putText(frame, f"{sign_idx + 1}/{len(signs)}", 
-                               (width - 120, 40),
-                               cv2.FONT_HERSHEY_SIMPLEX, 0.8, (100, 100, 100), 1)
-                    
-                    frames.append(frame)
+            # Frames stream from the renderer straight into the encoder
+            frames = self._iter_frames(signs, bg_template, OUTPUT_SIZE)
             
-            # Save as GIF
-            if frames:
-                imageio.mimsave(output_path, frames, fps=fps, loop=0)
-                logger.info(f"GIF created: {output_path} ({len(frames)} frames)")
-                return output_path
+            if output_format == "mp4":
+                frame_count = self._write_mp4(frames, tmp_path, fps, OUTPUT_SIZE)
+            else:
+                frame_count = self._write_gif(frames, tmp_path, fps)
             
-            return None
+            if not frame_count:
+                return None
+            
+            os.replace(tmp_path, output_path)
+            logger.info(f"{output_format.upper()} created: {output_path} ({frame_count} frames)")
+            return output_path
             
         except Exception as e:
             logger.error(f"GIF creation error: {e}", exc_info=True)
             return None
+        
+        finally:
+            # Only left behind when encoding failed
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    
+    def _iter_frames(self, signs: List[str], bg_template: np.ndarray,
+                     size: Tuple[int, int]) -> Iterator[Tuple[np.ndarray, int]]:
+        """
+        Yield (frame, repeat) pairs in order, scaled to size; repeat is how many ticks the frame stays on screen
+        Signs render concurrently (cv2 releases the GIL), at most RENDER_AHEAD at a time,
+        so only a few signs' frames are alive at once
+        """
+        total = len(signs)
+        
+        def render(sign_idx: int):
+            renderer, repeats = self._sign_renderer(signs[sign_idx])
+            # One (N, H, W, 3) block per sign, filled in place
+            out = np.empty((len(repeats),) + bg_template.shape, dtype=np.uint8)
+            renderer(out, bg_template, sign_idx, total)
+            # Downscale here so the encoder only ever sees small frames
+            return [cv2.resize(frame, size, interpolation=cv2.INTER_AREA) for frame in out], repeats
+        
+        pending = deque(_RENDER_POOL.submit(render, i) for i in range(min(RENDER_AHEAD, total)))
+        next_idx = len(pending)
+        
+        while pending:
+            block, repeats = pending.popleft().result()
+            if next_idx < total:
+                pending.append(_RENDER_POOL.submit(render, next_idx))
+                next_idx += 1
+            yield from zip(block, repeats)
+    
+    def _write_gif(self, frames: Iterable[Tuple[np.ndarray, int]], output_path: str, fps: int) -> int:
+        """Save frames as a looping GIF; returns the number of frames written"""
+        count = 0
+        
+        def images():
+            nonlocal count
+            for frame, repeat in frames:
+                # Map straight to the fixed palette; no per-frame quantization pass
+                image = _to_palette_image(frame)
+                # Held frames get a longer delay instead of duplicates
+                image.info["duration"] = repeat * 1000 // fps
+                count += 1
+                yield image
+        
+        images = images()
+        first = next(images, None)
+        if first is None:
+            return 0
+        
+        first.save(
+            output_path,
+            format="GIF",
+            save_all=True,
+            append_images=images,
+            loop=0,
+            disposal=2,
+            optimize=False
+        )
+        return count
+    
+    def _write_mp4(self, frames: Iterable[Tuple[np.ndarray, int]], output_path: str, fps: int, size: tuple) -> int:
+        """
+        Save frames as an MP4, preferring H.264 when OpenCV's build has an encoder for it
+        Returns the number of frames written
+        """
+        for codec in MP4_CODECS:
+            writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*codec), fps, size)
+            if writer.isOpened():
+                break
+            writer.release()
+        else:
+            logger.error("No MP4 encoder available")
+            return 0
+        
+        count = 0
+        try:
+            for frame, repeat in frames:
+                # Frames are RGB (as the GIF shows them); VideoWriter expects BGR
+                bgr = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+                # MP4 runs at a fixed rate, so held frames are written repeatedly
+                for _ in range(repeat):
+                    writer.write(bgr)
+                count += repeat
+        finally:
+            writer.release()
+        
+        return count
+    
+    def _sign_info(self, sign: str) -> Dict:
+        """Pose entry for a sign, with a still hand for unknown signs"""
+        return self.sign_database.get(sign, {
+            "frames": 10,
+            "hand_positions": [(300, 250)] * 10,
+            "description": sign
+        })
+    
+    def _sign_renderer(self, sign: str) -> Tuple[Callable, List[int]]:
+        """
+        Return (renderer, repeats) for a sign
+        renderer(out, bg_template, sign_idx, total) fills one slot of `out` per entry in repeats
+        """
+        entry = self._sign_renderers.get(sign)
+        
+        if entry is None:
+            sign_info = self._sign_info(sign)
+            # A hand that holds still is drawn once and shown for longer
+            positions, repeats = _run_lengths(sign_info["hand_positions"])
+            renderer = functools.partial(
+                self._render_sign_frames,
+                sign=sign,
+                label=f"Sign: {sign.upper()}",
+                description=sign_info["description"],
+                positions=tuple(positions)
+            )
+            entry = (renderer, repeats)
+            
+            # Unknown words get a placeholder pose; only cache real signs so the table stays bounded
+            if sign in self.sign_database:
+                self._sign_renderers[sign] = entry
+        
+        return entry
+    
+    def _render_sign_frames(self, out: np.ndarray, bg_template: np.ndarray, sign_idx: int, total: int, *,
+                            sign: str, label: str, description: str, positions: Tuple[tuple, ...]):
+        """Render every frame of one sign into `out` (one slot per hand position)"""
+        width = bg_template.shape[1]
+        
+        # Sign info and counter are the same for every frame of a sign
+        text_layer = bg_template.copy()
+        
+        # Draw sign info
+        _blit_text(text_layer, label, (20, 40), 1, (0, 0, 0), 2)
+        _blit_text(text_layer, description, (20, 70), 0.7, (100, 100, 100), 1)
+        
+        # Draw counter
+        _blit_text(text_layer, f"{sign_idx + 1}/{total}", (width - 120, 40), 0.8, (100, 100, 100), 1)
+        
+        # Every frame starts from the text layer
+        out[:] = text_layer
+        
+        draw_hand = self._draw_hand
+        for frame, (hand_x, hand_y) in zip(out, positions):
+            # Draw animated hand (it never reaches the text rows)
+            draw_hand(frame, hand_x, hand_y, sign)
     
     def _draw_body(self, frame: np.ndarray, center_x: int, center_y: int):
         """Draw avatar body"""
@@ -356,31 +660,13 @@ class SignLanguageGifGenerator:
         cv2.line(frame, (center_x + 15, center_y + 30), (center_x + 20, center_y + 80), (100, 100, 100), 3)
     
     def _draw_hand(self, frame: np.ndarray, hand_x: int, hand_y: int, sign: str):
-        """Draw animated hand"""
-        # Hand shape circle
-        hand_radius = 20
-        cv2.circle(frame, (hand_x, hand_y), hand_radius, (220, 180, 160), -1)
-        cv2.circle(frame, (hand_x, hand_y), hand_radius, (100, 100, 100), 2)
-        
-        # Fingers (simplified)
-        finger_length = 15
-        finger_angles = [0, 72, 144, 216, 288]  # 5 fingers equally spaced
-        
-        for angle in finger_angles:
-            rad = np.radians(angle)
-            end_x = int(hand_x + (hand_radius + finger_length) * np.cos(rad))
-            end_y = int(hand_y + (hand_radius + finger_length) * np.sin(rad))
-            cv2.line(frame, (hand_x, hand_y), (end_x, end_y), (100, 100, 100), 2)
-            cv2.circle(frame, (end_x, end_y), 3, (100, 100, 100), -1)
-        
-        # Palm details
-        cv2.circle(frame, (hand_x, hand_y), 8, (200, 150, 120), -1)
+        """Draw animated hand from the prerendered sprite"""
+        patch, mask, dx, dy = _HAND_SPRITE
+        _stamp(frame, patch, mask, hand_x + dx, hand_y + dy)
 
 
 if __name__ == "__main__":
     # Test the SignLanguageGifGenerator
-    import asyncio
-
     async def test_gif_generator():
         generator = SignLanguageGifGenerator()
         test_text = "Hello"